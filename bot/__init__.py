@@ -8,5 +8,9 @@ from .display_manager import DisplayManager
 from .config_manager import ConfigManager
 from .control_manager import ControlManager
 from .content_manager import ContentManager
-from .audiomixer import MixedAudio, MixedAudioSource
+from .audiomixer import MixedAudio, MixedAudioSource, MUSIC_LAYER, DEFAULT_AMBIENCE_LAYER
+from .stream_resolver import StreamResolver
+from .media_cache import MediaCache, AmbienceLoopCache, TrackCache
+from .track_metadata import TrackMetadataStore, LoudnessAnalyzer
+from .checkpoint import Checkpointer
 from .command_dispatcher import CommandDispatcher
\ No newline at end of file
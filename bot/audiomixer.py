@@ -1,110 +1,1337 @@
 # bot/audiomixer.py
 
-import subprocess, numpy as np, discord, os
+import subprocess, threading, signal, mmap, time, numpy as np, discord, os
+
+from collections import deque
+from discord.oggparse import OggStream, OggError
+
+BYTES_PER_MS = 48 * 2 * 2   # 48kHz, 16-bit, stereo
+FRAME_MS = 20
+DEFAULT_BUFFER_MS = int(os.getenv("AUDIO_BUFFER_MS", "200"))
+DEFAULT_ENGINE = os.getenv("MIXER_ENGINE", "float")
+DEFAULT_MAX_LAYERS = int(os.getenv("MIXER_MAX_LAYERS", "8"))
+DEFAULT_CROSSFADE_MS = int(os.getenv("MIXER_CROSSFADE_MS", "0"))   # 0 = gapless cut
+FFMPEG_STALL_MS = int(os.getenv("FFMPEG_STALL_MS", "5000"))         # no bytes this long = stalled
+FFMPEG_STDERR_LINES = int(os.getenv("FFMPEG_STDERR_LINES", "20"))   # stderr tail kept per process
+LOOP_CAPTURE_MB = int(os.getenv("LOOP_CAPTURE_MB", "64"))           # PCM kept in memory to loop a track
+
+MUSIC_LAYER = "music"               # the queue's current track
+DEFAULT_AMBIENCE_LAYER = "ambience" # used when a command does not name a layer
+
+MIX_ENGINES = ("float", "fixed")
+Q15_ONE = 1 << 15
+MAX_LAYER_GAIN = 4.0    # volume × loudness trim; past a total of 2.0 the fixed path widens to int64
+
+
+def to_q15(volume: float, ceiling: float = 1.0) -> int:
+    """Convert a 0.0–ceiling gain to a Q15 integer (1.0 → 32768)."""
+    return int(round(max(0.0, min(volume, ceiling)) * Q15_ONE))
+
+
+class _PipeReader:
+    """
+    Base for readers that drain one ffmpeg stdout pipe on their own thread.
+    - The player thread only ever takes from the buffer, so a network stall in
+      one ffmpeg process can no longer freeze the whole mix.
+    - Output starts once the pre-roll is buffered, and re-primes after an underrun.
+    Subclasses set up their buffer, then call this __init__ to start the thread.
+    """
+    def __init__(self, proc, name: str):
+        self.proc = proc
+        self._primed = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.eof = False
+        self.underruns = 0
+        self.last_data = time.monotonic()   # when ffmpeg last gave us anything
+
+        self._thread = threading.Thread(target=self._run, name=f"mixer-reader-{name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._drain()
+        except (OSError, ValueError, OggError):
+            pass  # pipe was closed underneath us by stop()
+        finally:
+            with self._cond:
+                self.eof = True
+                self._primed = True  # let whatever is left drain out
+                self._cond.notify_all()
+            try:
+                self.proc.stdout.close()
+            except (OSError, ValueError):
+                pass
+
+    def _drain(self):
+        raise NotImplementedError
+
+    @property
+    def primed(self) -> bool:
+        return self._primed
+
+    def stalled(self, now: float, limit: float) -> bool:
+        """ffmpeg is still running but has produced nothing for `limit` seconds."""
+        return not self.eof and now - self.last_data > limit
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class StreamReader(_PipeReader):
+    """
+    Raw s16le PCM reader backed by a bounded ring buffer of `preroll` bytes plus headroom.
+    `tail` reserves extra room so at least that much is still buffered when ffmpeg exits.
+    `capture` > 0 also keeps a copy of everything read, up to that many bytes (see `captured`).
+    """
+    def __init__(self, proc, chunk_size: int, preroll: int, name: str = "stream",
+                 tail: int = 0, capture: int = 0):
+        self.chunk_size = chunk_size
+        self.preroll = preroll
+        self.capacity = preroll + tail + chunk_size * 4
+
+        self.capture_limit = capture
+        self.capture = bytearray() if capture else None   # None once over the limit
+
+        self._ring = np.zeros(self.capacity, dtype=np.uint8)
+        self._start = 0             # read offset into the ring
+        self._size = 0              # bytes currently buffered
+
+        super().__init__(proc, name)
+
+    # ===== Reader Thread =====
+    def _drain(self):
+        scratch = bytearray(self.chunk_size)
+        view = memoryview(scratch)
+        src = np.frombuffer(scratch, dtype=np.uint8)
+
+        while not self._closed:
+            got = self.proc.stdout.readinto(view) or 0
+            if got == 0:
+                break
+            self._push(src, got)
+
+    def _push(self, src, count):
+        with self._cond:
+            # Block this thread (never the player) while the ring is full
+            while self.capacity - self._size < count and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return
+
+            end = (self._start + self._size) % self.capacity
+            first = min(count, self.capacity - end)
+            self._ring[end:end + first] = src[:first]
+            if first < count:
+                self._ring[:count - first] = src[first:count]
+
+            self._size += count
+            self.last_data = time.monotonic()
+
+            if self.capture is not None:
+                if len(self.capture) + count > self.capture_limit:
+                    self.capture = None  # too long to keep; give up on it
+                else:
+                    self.capture += src[:count].data
+
+            if self._size >= self.preroll:
+                self._primed = True
+
+    # ===== Player Side =====
+    def read_into(self, dst) -> int:
+        """
+        Copy up to one frame into dst (a uint8 array) without waiting.
+        Returns the number of bytes copied; 0 means the layer should be silent.
+        """
+        with self._cond:
+            if not self._primed:
+                return 0
+
+            if self._size < self.chunk_size and not self.eof:
+                # Ran dry mid-stream: count it and wait for the pre-roll again
+                self.underruns += 1
+                self._primed = False
+                return 0
+
+            count = min(self.chunk_size, self._size)
+            first = min(count, self.capacity - self._start)
+            dst[:first] = self._ring[self._start:self._start + first]
+            if first < count:
+                dst[first:count] = self._ring[:count - first]
+
+            self._start = (self._start + count) % self.capacity
+            self._size -= count
+            self._cond.notify_all()
+            return count
+
+    def skip(self, count: int) -> int:
+        """Discard up to `count` buffered bytes; returns how many were dropped."""
+        with self._cond:
+            count = min(count, self._size)
+            self._start = (self._start + count) % self.capacity
+            self._size -= count
+            self._cond.notify_all()
+            return count
+
+    @property
+    def buffered(self) -> int:
+        return self._size
+
+    @property
+    def captured(self):
+        """The whole stream's PCM, once ffmpeg finished it cleanly within the capture limit."""
+        if self.capture is None or not self.eof or self.proc.poll() != 0:
+            return None
+        return self.capture
+
+    @property
+    def drained(self) -> bool:
+        """True once ffmpeg has finished and every buffered byte was played."""
+        return self.eof and self._size == 0
+
+
+class OpusPacketReader(_PipeReader):
+    """
+    Demuxes Opus packets from an Ogg stream (ffmpeg `-c:a copy -f opus`) into a
+    bounded packet queue, so they can be sent to Discord without decode/encode.
+    """
+    def __init__(self, proc, preroll_packets: int, name: str = "stream"):
+        self.preroll = preroll_packets
+        self.capacity = preroll_packets + 4
+        self._packets = deque()
+
+        super().__init__(proc, name)
+
+    # ===== Reader Thread =====
+    def _drain(self):
+        for packet in OggStream(self.proc.stdout).iter_packets():
+            if self._closed:
+                return
+
+            # Stream headers are not audio
+            if packet[:8] in (b"OpusHead", b"OpusTags"):
+                continue
+
+            with self._cond:
+                while len(self._packets) >= self.capacity and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+
+                self._packets.append(packet)
+                self.last_data = time.monotonic()
+                if len(self._packets) >= self.preroll:
+                    self._primed = True
+
+    # ===== Player Side =====
+    def read_packet(self):
+        """Pop the next Opus packet without waiting, or None if the buffer is short."""
+        with self._cond:
+            if not self._primed:
+                return None
+
+            if not self._packets:
+                if not self.eof:
+                    self.underruns += 1
+                    self._primed = False
+                return None
+
+            packet = self._packets.popleft()
+            self._cond.notify_all()
+            return packet
+
+    @property
+    def drained(self) -> bool:
+        return self.eof and not self._packets
+
+
+class LoopedPCMSource:
+    """
+    Loops raw s16le audio forever, either from an mmap'd file or from a buffer
+    already in memory (`data`). Frames are sliced straight out of it, so there is
+    no ffmpeg process, no network and no pre-roll.
+    Offers the same player-side interface as StreamReader.
+    Clearing `repeat` lets the current pass finish and then reports drained.
+    """
+    def __init__(self, path: str, chunk_size: int, data=None):
+        self.chunk_size = chunk_size
+        self.path = path
+        self.eof = False
+        self.underruns = 0
+        self.primed = True
+        self.drained = False
+        self.repeat = True
+
+        if data is None:
+            with open(path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            source = self._mm
+        else:
+            self._mm = None
+            source = data
+
+        # Whole stereo samples only, so every loop starts on a frame boundary
+        usable = len(source) - len(source) % 4
+        if usable < chunk_size:
+            self._unmap()
+            raise ValueError(f"Clip too short to loop: {path}")
+
+        self._data = np.frombuffer(source, dtype=np.uint8, count=usable)
+        self._pos = 0
+
+    def read_into(self, dst) -> int:
+        if self.drained:
+            return 0
+
+        copied = 0
+        size = len(self._data)
+        while copied < self.chunk_size:
+            count = min(self.chunk_size - copied, size - self._pos)
+            dst[copied:copied + count] = self._data[self._pos:self._pos + count]
+            copied += count
+            self._pos = (self._pos + count) % size
+
+            if self._pos == 0 and not self.repeat:
+                self.eof = self.drained = True
+                break
+        return copied
+
+    def skip(self, count: int) -> int:
+        self._pos = (self._pos + count) % len(self._data)
+        return count
+
+    @property
+    def position(self) -> float:
+        """Seconds into the current pass."""
+        return self._pos / (BYTES_PER_MS * 1000)
+
+    def close(self):
+        if self._data is None:
+            return
+        self._data = None   # release the buffer export before unmapping
+        self._unmap()
+
+    def _unmap(self):
+        if self._mm is not None:
+            self._mm.close()
+
+
+class FFmpegSupervisor:
+    """
+    Owns the mixer's ffmpeg processes.
+    - Each process runs in its own session, so kill() takes out the whole process group.
+    - A watcher thread per process keeps a bounded stderr tail, then reaps it (no zombies).
+    - suspend()/resume() SIGSTOP/SIGCONT the group, so a paused stream costs no CPU.
+    - Counts spawns/kills and reports live processes, open FDs and child RSS.
+    """
+    def __init__(self, stderr_lines: int = FFMPEG_STDERR_LINES):
+        self.stderr_lines = stderr_lines
+        self._live = {}         # pid → (name, Popen)
+        self._tails = {}        # name → deque of recent stderr lines (kept after exit)
+        self._stopped = set()   # pids currently SIGSTOPped
+        self._lock = threading.Lock()
+
+        self.spawned = 0
+        self.killed = 0
+        self.failed = 0         # exited non-zero without being killed by us
+
+    def spawn(self, cmd, name):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        proc.killed = False
+        tail = deque(maxlen=self.stderr_lines)
+
+        with self._lock:
+            self._live[proc.pid] = (name, proc)
+            self._tails[name] = tail
+            self.spawned += 1
+
+        threading.Thread(target=self._watch, args=(proc, name, tail),
+                         name=f"ffmpeg-watch-{name}", daemon=True).start()
+        return proc
+
+    def _watch(self, proc, name, tail):
+        try:
+            for line in proc.stderr:
+                tail.append(line.decode(errors="replace").rstrip())
+        except (OSError, ValueError):
+            pass
+        finally:
+            proc.stderr.close()
+
+        code = proc.wait()
+        with self._lock:
+            self._live.pop(proc.pid, None)
+            self._stopped.discard(proc.pid)
+
+        if code and not proc.killed:
+            self.failed += 1
+            print(f"[FFMPEG] {name} exited with {code}: {tail[-1] if tail else 'no output'}")
+
+    def kill(self, proc):
+        """Kill proc's whole process group; the watcher thread reaps it."""
+        if proc is None or proc.returncode is not None:
+            return
+        proc.killed = True
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            proc.kill()
+        self.killed += 1
+
+    def _signal(self, proc, sig):
+        if proc is None or proc.returncode is not None:
+            return False
+        try:
+            os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return False
+        return True
+
+    def suspend(self, proc):
+        if self._signal(proc, signal.SIGSTOP):
+            with self._lock:
+                self._stopped.add(proc.pid)
+
+    def resume(self, proc):
+        if self._signal(proc, signal.SIGCONT):
+            with self._lock:
+                self._stopped.discard(proc.pid)
+
+    def tail(self, name):
+        return list(self._tails.get(name, ()))
+
+    def _child_rss(self):
+        page = os.sysconf("SC_PAGE_SIZE")
+        total = 0
+        for pid in list(self._live):
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * page
+            except (OSError, ValueError, IndexError):
+                pass
+        return total
+
+    @staticmethod
+    def _open_fds():
+        try:
+            return len(os.listdir("/proc/self/fd"))
+        except OSError:
+            return None
+
+    def stats(self):
+        with self._lock:
+            live = {pid: name for pid, (name, _) in self._live.items()}
+        return {
+            "processes": len(live),
+            "suspended": len(self._stopped),
+            "spawned": self.spawned,
+            "killed": self.killed,
+            "failed": self.failed,
+            "open_fds": self._open_fds(),
+            "rss_bytes": self._child_rss(),
+            "stderr": {name: tail[-1] for name, tail in self._tails.items() if tail},
+        }
+
+
+class Layer:
+    """
+    One named source in the mix (the music track, rain, a fireplace, ...).
+    Owns its ffmpeg process, reader, volume and a row in the mixer's frame stack.
+    """
+    def __init__(self, layer_id: str, row: int, volume: float = 1.0):
+        self.id = layer_id
+        self.row = row
+        self.volume = volume
+        self.trim = 1.0                 # per-source gain (loudness normalisation), on top of volume
+        self.paused = False
+
+        self.url = None
+        self.loop = False
+        self.opus = False               # source is Opus and may be passed through
+        self.proc = None
+        self.reader = None              # StreamReader / LoopedPCMSource while mixing as PCM
+        self.packet_reader = None       # OpusPacketReader while in passthrough
+        self.frames = 0                 # 20 ms frames played since the source start
+        self.ended = False              # end of this source already reported
+        self.stalled = False            # stall of this source already reported
+        self.repeat = False             # replay the source when it ends (captured PCM)
+
+        # PCM ffmpeg warming up to take over from passthrough, or from a seek
+        self.pending_proc = None
+        self.pending_reader = None
+        self.handoff_frame = 0
+        self.seek_frame = None          # set when the pending stream is a seek target
+        self.seek_url = None
+
+        # Standby source, swapped in the frame the current one plays out
+        self.next_proc = None
+        self.next_reader = None
+        self.next_url = None
+        self.next_loop = False
+        self.next_trim = 1.0
+        self.next_opus = False          # standby is Opus packets, to carry on in passthrough
+
+        # Previous source still fading out under the new one
+        self.fading_proc = None
+        self.fading_reader = None
+        self.fade_frame = 0
+
+    @property
+    def finished(self) -> bool:
+        """True when nothing is loaded or the source has fully played out."""
+        if self.pending_reader and not (self.packet_reader and self.packet_reader.drained):
+            return False  # mid-handoff; the PCM stream picks up where passthrough is
+        reader = self.packet_reader or self.reader
+        return reader is None or reader.drained
+
+    @property
+    def audible(self) -> bool:
+        return (self.reader or self.packet_reader) is not None and not self.paused and self.volume > 0
 
 
 class MixedAudio():
-    def __init__(self):
+    """
+    Mixes any number of named layers into 20 ms PCM frames for discord.py.
+
+    Every layer owns one row of a preallocated (layers × samples) stack, and a
+    frame is mixed in one vectorized pass: the gain vector times the stack.
+
+    When a single layer is audible, at unity gain, and its source is Opus, the
+    mixer switches to passthrough: Opus packets are demuxed by ffmpeg and handed
+    straight to Discord. Anything that needs real mixing (a second layer, a volume
+    change) hands that layer back to a PCM ffmpeg at the same position.
+
+    A layer can also hold a standby source (`prepare_next`): an ffmpeg started
+    ahead of time whose output is buffered but not mixed. It takes over in the
+    same frame the current source runs out, or crossfades in over the current
+    source's last `crossfade_ms` when that is enabled.
+    """
+    def __init__(self, buffer_ms: int = DEFAULT_BUFFER_MS, engine: str = DEFAULT_ENGINE,
+                 max_layers: int = DEFAULT_MAX_LAYERS, crossfade_ms: int = DEFAULT_CROSSFADE_MS):
         self.chunk_size = 960 * 4  # 3840 bytes for 16-bit stereo 48kHz
-        self.proc_amb = None
-        self.proc_music = None
-        self.music_volume = 1.0
-        self.ambience_volume = 0.25
-        self.music_paused = False
-        self.ambience_paused = False
-
-    def set_music_volume(self, volume: float):
-        self.music_volume = max(0.0, min(volume, 1.0))
-
-    def set_ambience_volume(self, volume: float):
-        self.ambience_volume = max(0.0, min(volume, 1.0))
-
-    def _start_ffmpeg(self, url, loop=False):
-        cmd = [
-            "ffmpeg",
-            "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5"
-        ]
+        self.max_layers = max_layers
+
+        # Jitter buffer depth per stream, rounded up to whole frames
+        frames = max(1, -(-buffer_ms * BYTES_PER_MS // self.chunk_size))
+        self.preroll = frames * self.chunk_size
+
+        # Active layers by id, plus a row-ordered tuple for read() to iterate
+        self.layers = {}
+        self._active = ()
+        self._underruns = {}            # from readers already stopped, by layer id
+        self.wasted_spawns = 0          # ffmpeg processes killed before a single frame played
+
+        self._passthrough = None        # Layer currently sent as Opus packets
+        self.last_frame_opus = False    # what the most recent read() returned
+        self._on_event = None           # (callback, event loop) told about layer ends/stalls
+        self.ffmpeg = FFmpegSupervisor()
+        self.capture_limit = LOOP_CAPTURE_MB * 1024 * 1024
+        self.stall_s = FFMPEG_STALL_MS / 1000
+        self.stalls = 0
+        self._lock = threading.RLock()  # guards layer changes against read()
+
+        # Preallocated buffers, reused by read() so mixing a frame allocates nothing
+        samples = self.chunk_size // 2
+        self._stack_i16 = np.zeros((max_layers, samples), dtype=np.int16)
+        self._stack_u8 = self._stack_i16.view(np.uint8)
+        self._rows_u8 = [self._stack_u8[row] for row in range(max_layers)]
+
+        self._stack_f32 = np.zeros((max_layers, samples), dtype=np.float32)
+        self._gains_f32 = np.zeros(max_layers, dtype=np.float32)
+        self._mix_f32 = np.zeros(samples, dtype=np.float32)
+
+        # Q15 gains, applied row by row in place and summed into row 0 (integer matmul gets
+        # no BLAS). int32 while the gains total at most 2.0, otherwise int64.
+        self._stack_i32 = np.zeros((max_layers, samples), dtype=np.int32)
+        self._stack_i64 = np.zeros((max_layers, samples), dtype=np.int64)
+        self._rows_i32 = [self._stack_i32[row] for row in range(max_layers)]
+        self._rows_i64 = [self._stack_i64[row] for row in range(max_layers)]
+        self._gains_i32 = [np.int32(0)] * max_layers     # numpy scalars: no conversion per frame
+        self._gains_i64 = [np.int64(0)] * max_layers
+        self._fixed_wide = False
+
+        self._out_buf = bytearray(self.chunk_size)
+        self._out_view = memoryview(self._out_buf)
+        self._out_i16 = np.frombuffer(self._out_buf, dtype=np.int16)
+
+        # Equal-power crossfade: per-frame cos/sin gain rows, computed once
+        self.crossfade_frames = max(0, crossfade_ms) // FRAME_MS
+        self._fade_bytes = self.crossfade_frames * self.chunk_size
+        pairs = self.crossfade_frames * samples // 2
+        theta = (np.arange(pairs, dtype=np.float32) + 0.5) * (np.pi / 2 / max(pairs, 1))
+        self._fade_in = np.repeat(np.sin(theta), 2).reshape(self.crossfade_frames, samples)
+        self._fade_out = np.repeat(np.cos(theta), 2).reshape(self.crossfade_frames, samples)
+        self._fade_u8 = np.zeros(self.chunk_size, dtype=np.uint8)
+        self._fade_i16 = self._fade_u8.view(np.int16)
+        self._fade_new_f32 = np.zeros(samples, dtype=np.float32)
+        self._fade_old_f32 = np.zeros(samples, dtype=np.float32)
+
+        self.engine = None
+        self._mix = None
+        self.set_engine(engine)
+
+    def set_engine(self, engine: str):
+        """Switch between the float32 and the Q15 fixed-point mixing paths."""
+        if engine not in MIX_ENGINES:
+            raise ValueError(f"Unknown mixer engine '{engine}' (expected one of {MIX_ENGINES})")
+
+        # A single attribute swap, so the player thread picks it up on its next frame
+        self._mix = self._mix_fixed if engine == "fixed" else self._mix_float
+        self.engine = engine
+
+    def set_event_callback(self, callback, loop):
+        """
+        Call `callback(layer_id, event)` on `loop` from the player thread:
+        - "ended": the layer's source played out (first empty frame, once per source)
+        - "advanced": the standby source took over from the one that ran out
+        - "stalled": ffmpeg is alive but sent nothing for FFMPEG_STALL_MS (once per source)
+        """
+        self._on_event = (callback, loop)
+
+    def _emit(self, layer_id, event):
+        if self._on_event:
+            callback, loop = self._on_event
+            try:
+                loop.call_soon_threadsafe(callback, layer_id, event)
+            except RuntimeError:
+                pass  # event loop already closed (shutting down)
+
+    def _check_stall(self, layer, reader):
+        """Called when a layer came up empty: report it if ffmpeg has gone quiet."""
+        if layer.stalled or layer.proc is None or not reader.stalled(time.monotonic(), self.stall_s):
+            return
+        layer.stalled = True
+        self.stalls += 1
+        print(f"[MIXER] Layer '{layer.id}' stalled: {self.ffmpeg.tail(layer.id)[-1:] or 'no stderr'}")
+        self._emit(layer.id, "stalled")
+
+    def _report_end(self, layer):
+        if layer.ended or (layer.reader or layer.packet_reader) is None or not layer.finished:
+            return
+        layer.ended = True
+        self._emit(layer.id, "ended")
+
+    def _start_ffmpeg(self, url, loop=False, offset=0.0, opus=False, name="stream"):
+        cmd = ["ffmpeg"]
+        if not os.path.exists(url):
+            # HTTP input options; ffmpeg rejects them for local files
+            cmd += ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5"]
         if loop:
             cmd += ["-stream_loop", "-1"]
+        if offset:
+            cmd += ["-ss", f"{offset:.3f}"]
+        cmd += ["-i", url]
+        if opus:
+            # Remux the Opus packets as-is; no decoding
+            cmd += ["-map", "0:a:0", "-c:a", "copy", "-f", "opus"]
+        else:
+            cmd += ["-f", "s16le", "-ar", "48000", "-ac", "2"]
         cmd += [
-            "-i", url,
-            "-f", "s16le",
-            "-ar", "48000",
-            "-ac", "2",
             "pipe:1",
-            "-loglevel", "quiet"
+            "-loglevel", "error"
         ]
-        return subprocess.Popen(cmd, stdout=subprocess.PIPE, preexec_fn=os.setsid)
+        return self.ffmpeg.spawn(cmd, name)
+
+    def _stop_reader(self, reader, layer_id):
+        if reader:
+            reader.close()
+            self._underruns[layer_id] = self._underruns.get(layer_id, 0) + reader.underruns
+
+    # ===== Layer Management =====
+    def _get_or_create(self, layer_id, volume):
+        layer = self.layers.get(layer_id)
+        if layer:
+            return layer
+
+        if len(self.layers) >= self.max_layers:
+            raise ValueError(f"Mixer is full ({self.max_layers} layers)")
+
+        layer = Layer(layer_id, row=len(self.layers), volume=volume)
+        self.layers[layer_id] = layer
+        self._sync_rows()
+        return layer
+
+    def _sync_rows(self):
+        """Keep active layers packed into rows 0..n-1 and refresh the gain vector."""
+        self._active = tuple(self.layers.values())
+        for row, layer in enumerate(self._active):
+            layer.row = row
+            self._update_gain(layer)
+
+    def _update_gain(self, layer):
+        gain = min(layer.volume * layer.trim, MAX_LAYER_GAIN)
+        self._gains_f32[layer.row] = gain
+        q15 = to_q15(gain, ceiling=MAX_LAYER_GAIN)
+        self._gains_i32[layer.row] = np.int32(q15)
+        self._gains_i64[layer.row] = np.int64(q15)
+
+        # int32 holds 32768 × a Q15 gain total of up to 2.0 (65536)
+        self._fixed_wide = sum(int(g) for g in self._gains_i64[:len(self._active)]) > 2 * Q15_ONE
+
+    def layer(self, layer_id):
+        return self.layers.get(layer_id)
+
+    def layer_ids(self):
+        return list(self.layers)
 
     # ===== Control Methods =====
-    def start_ambience(self, url, loop=True):
-        self.stop_ambience()  # Prevent multiple
-        self.proc_amb = self._start_ffmpeg(url, loop=loop)
+    def start_layer(self, layer_id, url, loop=False, opus=False, volume=1.0, offset=0.0, capture=False,
+                    trim=None):
+        """
+        Start (or replace) the source of a layer. `opus` marks the source as
+        Opus-encoded, which lets it play in passthrough while nothing else needs mixing.
+        `volume` only applies when the layer is new; an existing layer keeps its own.
+        `offset` starts that many seconds in, and the layer's position counts on from there.
+        `capture` keeps the decoded PCM (within `capture_limit`) so a repeat needs no ffmpeg.
+        `trim` sets the source's own gain (e.g. loudness normalisation); None keeps the current one.
+        """
+        with self._lock:
+            self._stop_source(layer_id)
+            layer = self._get_or_create(layer_id, max(0.0, min(volume, 1.0)))
+            if trim is not None:
+                layer.trim = trim
+                self._update_gain(layer)
+            layer.url = url
+            layer.loop = loop
+            layer.opus = opus and not loop
+            layer.frames = int(offset * 1000) // FRAME_MS
+            layer.ended = layer.stalled = False
+            layer.paused = False
+
+            passthrough = self._passthrough_allowed(layer)
+
+        # Spawning takes a few ms, so keep it outside the lock read() needs
+        proc = self._start_ffmpeg(url, loop=loop, offset=offset, opus=passthrough, name=layer_id)
+        tail = 0 if loop else self._fade_bytes
+        capture = self.capture_limit if capture and not (loop or offset or passthrough) else 0
+
+        with self._lock:
+            if self.layers.get(layer_id) is not layer or layer.url != url:
+                self.ffmpeg.kill(proc)  # replaced or stopped while we were spawning
+                self.wasted_spawns += 1
+                return
+
+            layer.proc = proc
+            if passthrough:
+                layer.packet_reader = OpusPacketReader(proc, self.preroll // self.chunk_size, layer_id)
+                self._passthrough = layer
+            else:
+                layer.reader = StreamReader(proc, self.chunk_size, self.preroll, layer_id,
+                                            tail=tail, capture=capture)
+
+        self._check_passthrough()
+
+    def fits_capture(self, seconds) -> bool:
+        return bool(seconds) and seconds * 1000 * BYTES_PER_MS <= self.capture_limit
+
+    def set_repeat(self, layer_id, repeat: bool):
+        """
+        Replay the layer's source from its in-memory capture when it ends.
+        Turning it off lets a pass already looping from memory finish first.
+        """
+        with self._lock:
+            layer = self.layers.get(layer_id)
+            if layer is None or layer.loop:
+                return
+            layer.repeat = repeat
+            if layer.proc is None and isinstance(layer.reader, LoopedPCMSource):
+                layer.reader.repeat = repeat
+
+    def repeating(self, layer_id) -> bool:
+        """The layer already repeats by itself (looping ffmpeg or captured PCM), or will once captured."""
+        layer = self.layers.get(layer_id)
+        if layer is None:
+            return False
+        if layer.loop or isinstance(layer.reader, LoopedPCMSource):
+            return True
+        return isinstance(layer.reader, StreamReader) and layer.reader.capture is not None
+
+    def prepare_next(self, layer_id, url, loop=False, trim=1.0, opus=False) -> bool:
+        """
+        Start the layer's next source now so it is buffered before the current
+        one ends. Returns False if the layer changed while ffmpeg was spawning.
+        `loop` runs it with -stream_loop (a repeat that could not be captured).
+        `trim` becomes the layer's trim when it takes over.
+        `opus` marks the source as Opus: if it could play in passthrough, it is
+        buffered as packets and the layer stays (or goes) in passthrough at the swap.
+        """
+        with self._lock:
+            layer = self.layers.get(layer_id)
+            if layer is None or layer.loop or layer.url is None:
+                return False
+            self._drop_next(layer)
+            current = layer.url
+            opus = opus and self._standby_passthrough(layer, trim, loop)
+
+        name = f"{layer_id}-next"
+        proc = self._start_ffmpeg(url, loop=loop, opus=opus, name=name)
+
+        with self._lock:
+            if self.layers.get(layer_id) is not layer or layer.url != current or layer.next_proc:
+                self.ffmpeg.kill(proc)
+                self.wasted_spawns += 1
+                return False
+
+            layer.next_proc, layer.next_url, layer.next_loop = proc, url, loop
+            layer.next_trim = trim
+            layer.next_opus = opus
+            if opus:
+                layer.next_reader = OpusPacketReader(proc, self.preroll // self.chunk_size, name)
+            else:
+                layer.next_reader = StreamReader(proc, self.chunk_size, self.preroll,
+                                                 name, tail=0 if loop else self._fade_bytes)
+            return True
+
+    def seek_layer(self, layer_id, url, offset) -> bool:
+        """
+        Restart the layer's source `offset` seconds in. The current audio keeps
+        playing until the new ffmpeg has its pre-roll buffered, then it takes over.
+        """
+        with self._lock:
+            layer = self.layers.get(layer_id)
+            if layer is None or layer.url is None:
+                return False
+            self._drop_pending(layer)
+            current, loop = layer.url, layer.loop
+
+        offset = max(0.0, offset)
+        proc = self._start_ffmpeg(url, loop=loop, offset=offset, name=layer_id)
+
+        with self._lock:
+            if self.layers.get(layer_id) is not layer or layer.url != current or layer.pending_proc:
+                self.ffmpeg.kill(proc)
+                self.wasted_spawns += 1
+                return False
+
+            layer.pending_proc = proc
+            layer.pending_reader = StreamReader(proc, self.chunk_size, self.preroll, layer_id,
+                                                tail=0 if loop else self._fade_bytes)
+            layer.seek_frame = int(offset * 1000) // FRAME_MS
+            layer.seek_url = url
+            return True
+
+    def _finish_seek(self, layer) -> bool:
+        """Swap a primed seek target in. Called from read(); returns True once it has."""
+        if not layer.pending_reader.primed:
+            return False
+
+        old_proc, old_reader, old_packets = layer.proc, layer.reader, layer.packet_reader
+        layer.proc, layer.reader = layer.pending_proc, layer.pending_reader
+        layer.packet_reader = None
+        layer.pending_proc = layer.pending_reader = None
+        layer.url = layer.seek_url
+        layer.frames, layer.seek_frame = layer.seek_frame, None
+        layer.opus = False      # seek targets are decoded to PCM
+        layer.ended = layer.stalled = False
+
+        if self._passthrough is layer:
+            self._passthrough = None
+        self.ffmpeg.kill(old_proc)
+        self._stop_reader(old_reader, layer.id)
+        self._stop_reader(old_packets, layer.id)
+        self._end_fade(layer)
+        return True
+
+    def clear_next(self, layer_id):
+        """Discard a prepared next source (the queue changed under it)."""
+        with self._lock:
+            layer = self.layers.get(layer_id)
+            if layer:
+                self._drop_next(layer)
+
+    def has_next(self, layer_id) -> bool:
+        layer = self.layers.get(layer_id)
+        return layer is not None and layer.next_reader is not None
+
+    def _drop_next(self, layer):
+        if layer.next_proc:
+            self.ffmpeg.kill(layer.next_proc)
+            self.wasted_spawns += 1
+        if layer.next_reader:
+            layer.next_reader.close()
+        layer.next_proc = layer.next_reader = layer.next_url = None
+        layer.next_loop = layer.next_opus = False
+
+    def _end_fade(self, layer):
+        if layer.fading_proc:
+            self.ffmpeg.kill(layer.fading_proc)
+        self._stop_reader(layer.fading_reader, layer.id)
+        layer.fading_proc = layer.fading_reader = None
+
+    def start_cached_layer(self, layer_id, path, volume=1.0):
+        """Loop a decoded s16le file from disk in-process (see AmbienceLoopCache)."""
+        source = LoopedPCMSource(path, self.chunk_size)
+
+        with self._lock:
+            self._stop_source(layer_id)
+            layer = self._get_or_create(layer_id, max(0.0, min(volume, 1.0)))
+            layer.url = path
+            layer.loop = True
+            layer.frames = 0
+            layer.ended = layer.stalled = False
+            layer.paused = False
+            layer.reader = source
+
+        self._check_passthrough()
+
+    def _has_live_source(self, layer):
+        if layer.proc is not None:
+            return layer.proc.poll() is None
+        return layer.reader is not None
+
+    @staticmethod
+    def _procs(layer):
+        return (layer.proc, layer.pending_proc, layer.next_proc, layer.fading_proc)
+
+    def pause_layer(self, layer_id):
+        """Stop mixing the layer and SIGSTOP its ffmpeg processes (what is buffered stays)."""
+        with self._lock:
+            layer = self.layers.get(layer_id)
+            if not layer or not self._has_live_source(layer):
+                return
+            layer.paused = True
+            for proc in self._procs(layer):
+                self.ffmpeg.suspend(proc)
+
+    def resume_layer(self, layer_id):
+        with self._lock:
+            layer = self.layers.get(layer_id)
+            if not layer or not self._has_live_source(layer):
+                return
+            for proc in self._procs(layer):
+                self.ffmpeg.resume(proc)
+
+            # The pause was not a stall
+            now = time.monotonic()
+            for reader in (layer.reader, layer.packet_reader, layer.pending_reader, layer.next_reader):
+                if isinstance(reader, _PipeReader):
+                    reader.last_data = now
+
+            layer.paused = False
+
+        self._check_passthrough()
+
+    def park_layer(self, layer_id):
+        """
+        Tear down a paused layer's ffmpeg (and its network connection) but keep
+        the layer, its volume and its position. Returns the position in seconds,
+        or None if there was nothing to park. Restart it with start_layer(offset=...).
+        """
+        with self._lock:
+            layer = self.layers.get(layer_id)
+            if not layer or not layer.paused or layer.proc is None:
+                return None
 
-    def pause_ambience(self):
-        if self.proc_amb and self.proc_amb.poll() is None:
-            self.ambience_paused = True
+            position = self.position(layer_id)
+            self._stop_source(layer_id)
+            return position
 
-    def resume_ambience(self):
-        if self.proc_amb and self.proc_amb.poll() is None:
-            self.ambience_paused = False
+    def stop_layer(self, layer_id):
+        """Stop a layer's source and remove it from the mix."""
+        with self._lock:
+            self._stop_source(layer_id)
+            if self.layers.pop(layer_id, None):
+                self._sync_rows()
 
-    def stop_ambience(self):
-        if self.proc_amb:
-            self.proc_amb.kill()
-            self.proc_amb = None
+    def _stop_source(self, layer_id):
+        layer = self.layers.get(layer_id)
+        if not layer:
+            return
 
-    def start_music(self, url, loop=False):
-        self.stop_music()
-        self.proc_music = self._start_ffmpeg(url, loop=loop)
+        if layer.proc:
+            self.ffmpeg.kill(layer.proc)
+            layer.proc = None
+            if layer.frames == 0:
+                self.wasted_spawns += 1
+        self._stop_reader(layer.reader, layer_id)
+        self._stop_reader(layer.packet_reader, layer_id)
+        layer.reader = layer.packet_reader = None
+        self._drop_pending(layer)
+        self._drop_next(layer)
+        self._end_fade(layer)
 
-    def pause_music(self):
-        if self.proc_music and self.proc_music.poll() is None:
-            self.music_paused = True
+        if self._passthrough is layer:
+            self._passthrough = None
+        layer.url = None
+        layer.opus = False
 
-    def resume_music(self):
-        if self.proc_music and self.proc_music.poll() is None:
-            self.music_paused = False
+    def set_volume(self, layer_id, volume: float):
+        with self._lock:
+            layer = self.layers.get(layer_id)
+            if not layer:
+                return
+            layer.volume = max(0.0, min(volume, 1.0))
+            self._update_gain(layer)   # gains and the int32/int64 choice change together
+        self._check_passthrough()
 
-    def stop_music(self):
-        if self.proc_music:
-            self.proc_music.kill()
-            self.proc_music = None
+    def get_volume(self, layer_id, default=None):
+        layer = self.layers.get(layer_id)
+        return layer.volume if layer else default
+
+    def position(self, layer_id):
+        """
+        Seconds into the layer's current source, counted from the frames read()
+        has delivered (plus the offset it was started or seeked at). A pending
+        seek already reports its target.
+        """
+        layer = self.layers.get(layer_id)
+        if layer is None:
+            return 0.0
+        if layer.proc is None and isinstance(layer.reader, LoopedPCMSource):
+            return layer.reader.position
+        frames = layer.frames if layer.seek_frame is None else layer.seek_frame
+        return frames * FRAME_MS / 1000
+
+    def layer_finished(self, layer_id):
+        """True when the layer is missing, empty, or has fully played out."""
+        layer = self.layers.get(layer_id)
+        return layer is None or layer.finished
+
+    # ===== Opus Passthrough =====
+    @property
+    def passthrough(self) -> bool:
+        return self._passthrough is not None
+
+    def _passthrough_allowed(self, layer) -> bool:
+        """The layer is Opus, at unity gain, and nothing else would be heard."""
+        if not layer.opus or layer.volume != 1.0 or layer.trim != 1.0:
+            return False
+        return not any(other.audible for other in self._active if other is not layer)
+
+    def _standby_passthrough(self, layer, trim, loop) -> bool:
+        """
+        The layer's next source could pass through if it is Opus: what _passthrough_allowed
+        asks, for the standby's own trim. A crossfade needs both sources as PCM.
+        """
+        if loop or self.crossfade_frames or layer.volume != 1.0 or trim != 1.0:
+            return False
+        return not any(other.audible for other in self._active if other is not layer)
+
+    def _needs_handoff(self, layer) -> bool:
+        return (layer is not None and self._passthrough is layer and not layer.pending_reader
+                and not self._passthrough_allowed(layer))
+
+    def _check_passthrough(self):
+        """
+        Leave passthrough when mixing is needed again. A PCM ffmpeg is started a
+        little ahead of the current position and takes over once it is primed.
+        Call without holding the lock: the spawn happens outside it.
+        """
+        self._check_opus_standby()
+
+        with self._lock:
+            layer = self._passthrough
+            if not self._needs_handoff(layer):
+                return
+
+            # Lead by the pre-roll plus roughly one ffmpeg/network startup
+            lead_frames = self.preroll // self.chunk_size + 25
+            handoff_frame = layer.frames + lead_frames
+            url = layer.url
+
+        proc = self._start_ffmpeg(url, offset=handoff_frame * FRAME_MS / 1000, name=layer.id)
+
+        with self._lock:
+            if not self._needs_handoff(layer) or layer.url != url:
+                self.ffmpeg.kill(proc)  # handed off, replaced or no longer needed meanwhile
+                self.wasted_spawns += 1
+                return
+            layer.handoff_frame = handoff_frame
+            layer.pending_proc = proc
+            layer.pending_reader = StreamReader(proc, self.chunk_size, self.preroll, layer.id)
+
+    def _check_opus_standby(self):
+        """An Opus standby that could no longer pass through is prepared again as PCM."""
+        with self._lock:
+            layer = next((layer for layer in self._active if layer.next_opus
+                          and not self._standby_passthrough(layer, layer.next_trim, layer.next_loop)), None)
+            if layer is None:
+                return
+            url, trim = layer.next_url, layer.next_trim
+
+        self.prepare_next(layer.id, url, trim=trim)
+
+    def _try_handoff(self, layer) -> bool:
+        """
+        Swap the warmed-up PCM stream in once it lines up with the passthrough
+        position. Called from read(); returns True once PCM owns the layer.
+        """
+        if layer.seek_frame is not None:
+            return self._finish_seek(layer)
+
+        pending = layer.pending_reader
+        if pending.drained:
+            # ffmpeg ended with nothing to hand over: the offset was past the end, or it
+            # failed. Keep passing through; a later _check_passthrough() can try again.
+            self._drop_pending(layer)
+            return False
+        if not pending.primed:
+            return False
+
+        behind = layer.frames - layer.handoff_frame
+        if behind < 0:
+            return False  # pending stream starts later in the track; keep passing through
+
+        if behind:
+            dropped = pending.skip(behind * self.chunk_size) // self.chunk_size
+            layer.handoff_frame += dropped
+            if dropped < behind:
+                return False
+
+        old_proc, old_reader = layer.proc, layer.packet_reader
+        layer.proc, layer.reader = layer.pending_proc, pending
+        layer.pending_proc = layer.pending_reader = None
+        layer.packet_reader = None
+        self._passthrough = None
+
+        if old_proc:
+            self.ffmpeg.kill(old_proc)
+        self._stop_reader(old_reader, layer.id)
+        return True
+
+    def _drop_pending(self, layer):
+        if layer.pending_proc:
+            self.ffmpeg.kill(layer.pending_proc)
+        if layer.pending_reader:
+            layer.pending_reader.close()
+        layer.pending_proc = layer.pending_reader = None
+        layer.seek_frame = None
+
+    def _read_passthrough(self):
+        """Next Opus packet to send as-is, or None to produce a PCM frame instead."""
+        layer = self._passthrough
+        if layer is None or layer.paused:
+            return None
+        if layer.pending_reader and self._try_handoff(layer):
+            return None
+
+        packet = layer.packet_reader.read_packet()
+        if packet is not None:
+            layer.frames += 1  # YouTube Opus uses 20 ms packets
+        else:
+            self._check_stall(layer, layer.packet_reader)
+        return packet
+
+    # ===== Standby / Crossfade =====
+    def _advance_due(self, layer) -> bool:
+        """The standby should take over: the source ran out, or its crossfade window began."""
+        if layer.finished:
+            return True
+        if not self.crossfade_frames or layer.reader is None or not layer.next_reader.primed:
+            return False
+
+        # The ring keeps `tail` bytes back, so ffmpeg exits with a full fade still buffered
+        reader = layer.reader
+        left = reader.buffered if reader.eof else -1
+        return self._fade_bytes - self.chunk_size < left <= self._fade_bytes
+
+    def _advance_opus(self):
+        """
+        Swap a played-out source for its Opus standby before the frame is produced,
+        so passthrough carries on into the next track without a PCM frame in between.
+        """
+        for layer in self._active:
+            if layer.next_opus and not layer.paused and layer.finished:
+                self._swap_in_next(layer)
+
+    def _swap_in_next(self, layer):
+        """Make the standby the layer's source; fade the old one out if it still has audio."""
+        if layer.next_opus and not self._standby_passthrough(layer, layer.next_trim, layer.next_loop):
+            # Mixing is needed now and the PCM standby is not ready yet: end normally instead
+            self._drop_next(layer)
+            return
+
+        self._end_fade(layer)
+        self._drop_pending(layer)   # a handoff or seek meant for the old source
+
+        old_proc, old_reader = layer.proc, layer.reader
+        self._stop_reader(layer.packet_reader, layer.id)
+        if self._passthrough is layer:
+            self._passthrough = None
+
+        layer.proc, layer.url = layer.next_proc, layer.next_url
+        if layer.next_opus:
+            layer.reader, layer.packet_reader = None, layer.next_reader
+            self._passthrough = layer
+        else:
+            layer.reader, layer.packet_reader = layer.next_reader, None
+        layer.opus = layer.next_opus
+        layer.loop = layer.next_loop
+        layer.trim = layer.next_trim
+        self._update_gain(layer)
+        layer.next_proc = layer.next_reader = layer.next_url = None
+        layer.next_opus = False
+        layer.frames = 0
+        layer.ended = layer.stalled = False
+
+        if old_reader is not None and not old_reader.drained:
+            layer.fading_proc, layer.fading_reader = old_proc, old_reader
+            layer.fade_frame = 0
+        else:
+            if old_proc:
+                self.ffmpeg.kill(old_proc)
+            self._stop_reader(old_reader, layer.id)
+
+        self._emit(layer.id, "advanced")
+
+    def _crossfade(self, layer):
+        """Mix the outgoing source into the layer's row under cos/sin gain curves."""
+        k = layer.fade_frame
+        got = layer.fading_reader.read_into(self._fade_u8)
+        if got < self.chunk_size:
+            self._fade_u8[got:] = 0
+
+        row = self._stack_i16[layer.row]
+        np.multiply(row, self._fade_in[k], out=self._fade_new_f32)
+        np.multiply(self._fade_i16, self._fade_out[k], out=self._fade_old_f32)
+        np.add(self._fade_new_f32, self._fade_old_f32, out=self._fade_new_f32)
+        np.minimum(self._fade_new_f32, 32767, out=self._fade_new_f32)
+        np.maximum(self._fade_new_f32, -32768, out=self._fade_new_f32)
+        np.copyto(row, self._fade_new_f32, casting="unsafe")
+
+        layer.fade_frame += 1
+        if layer.fade_frame >= self.crossfade_frames or layer.fading_reader.drained:
+            self._end_fade(layer)
+
+    def _repeat_from_capture(self, layer) -> bool:
+        """The source ran out with repeat on: loop its captured PCM from memory from now on."""
+        reader = layer.reader
+        data = reader.captured if isinstance(reader, StreamReader) else None
+        if data is None:
+            return False
+        try:
+            source = LoopedPCMSource(layer.url, self.chunk_size, data=data)
+        except ValueError:
+            return False
+
+        self.ffmpeg.kill(layer.proc)
+        layer.proc = None
+        self._stop_reader(reader, layer.id)
+        layer.reader = source
+        layer.frames = 0
+        layer.ended = layer.stalled = False
+        self._emit(layer.id, "looped")
+        return True
 
     # ===== Mixing =====
+    def _fill(self, layer, dst):
+        """Copy one buffered frame into the layer's row; anything missing is silence."""
+        if layer.seek_frame is not None:
+            self._finish_seek(layer)
+        if layer.repeat and layer.proc and layer.finished and not layer.paused:
+            self._repeat_from_capture(layer)
+        if layer.next_reader and not layer.paused and self._advance_due(layer):
+            self._swap_in_next(layer)
+
+        got = 0
+        if layer.reader and not layer.paused:
+            got = layer.reader.read_into(dst)
+            if got:
+                layer.frames += 1
+
+        # pad missing bytes with silence
+        if got < self.chunk_size:
+            dst[got:] = 0
+            if got == 0 and layer.reader and not layer.paused:
+                self._check_stall(layer, layer.reader)
+            self._report_end(layer)
+
+        if layer.fading_reader and not layer.paused:
+            self._crossfade(layer)
+
     def read(self):
+        """
+        Return the next 20 ms frame: either an Opus packet in passthrough mode
+        (see `last_frame_opus`), or mixed PCM as a memoryview over a reused
+        buffer that is only valid until the next call.
+        """
+        with self._lock:
+            self._advance_opus()
+            packet = self._read_passthrough()
+            if packet is not None:
+                self.last_frame_opus = True
+                return packet
+            self.last_frame_opus = False
 
-        # Read chunks or produce silence if paused
-        if self.proc_amb and not self.ambience_paused:
-            amb_chunk = self.proc_amb.stdout.read(self.chunk_size)
-        else:
-            amb_chunk = b'\x00' * self.chunk_size
+            active = self._active
+            for layer in active:
+                self._fill(layer, self._rows_u8[layer.row])
+
+            if active:
+                self._mix(len(active))
+            else:
+                self._out_i16.fill(0)
+
+            return self._out_view
 
-        if self.proc_music and not self.music_paused:
-            music_chunk = self.proc_music.stdout.read(self.chunk_size)
+    def _mix_float(self, n):
+        """Widen the stack to float32, apply the gain vector in one matmul, clip and narrow."""
+        # np.clip goes through a Python wrapper that allocates; the raw ufuncs do not
+        stack = self._stack_f32[:n]
+        np.copyto(stack, self._stack_i16[:n])
+        np.matmul(self._gains_f32[:n], stack, out=self._mix_f32)
+        np.minimum(self._mix_f32, 32767, out=self._mix_f32)
+        np.maximum(self._mix_f32, -32768, out=self._mix_f32)
+        np.copyto(self._out_i16, self._mix_f32, casting="unsafe")
+
+    def _mix_fixed(self, n):
+        """Same pass in integers: Q15 gains row by row in place, summed into row 0, shifted back and saturated."""
+        if self._fixed_wide:
+            stack, rows, gains = self._stack_i64, self._rows_i64, self._gains_i64
         else:
-            music_chunk = b'\x00' * self.chunk_size
+            stack, rows, gains = self._stack_i32, self._rows_i32, self._gains_i32
+
+        np.copyto(stack[:n], self._stack_i16[:n])
+        acc = rows[0]
+        np.multiply(acc, gains[0], out=acc)
+        for row in range(1, n):
+            np.multiply(rows[row], gains[row], out=rows[row])
+            np.add(acc, rows[row], out=acc)
 
+        np.right_shift(acc, 15, out=acc)
+        np.minimum(acc, 32767, out=acc)
+        np.maximum(acc, -32768, out=acc)
+        np.copyto(self._out_i16, acc, casting="unsafe")
 
-        # pad missing chunks with silence
-        if len(amb_chunk) < self.chunk_size:
-            amb_chunk += b'\x00' * (self.chunk_size - len(amb_chunk))
-        if len(music_chunk) < self.chunk_size:
-            music_chunk += b'\x00' * (self.chunk_size - len(music_chunk))
+    # ===== Stats =====
+    def stats(self):
+        """Counters for the IPC state payload."""
+        underruns = dict(self._underruns)
+        for layer in self._active:
+            for reader in (layer.reader, layer.packet_reader):
+                if reader:
+                    underruns[layer.id] = underruns.get(layer.id, 0) + reader.underruns
 
-        amb_np = np.frombuffer(amb_chunk, dtype=np.int16).astype(np.float32) * self.ambience_volume
-        music_np = np.frombuffer(music_chunk, dtype=np.int16).astype(np.float32) * self.music_volume
+        return {
+            "engine": self.engine,
+            "layers": len(self._active),
+            "passthrough": self._passthrough.id if self._passthrough else None,
+            "underruns": underruns,
+            "trims": {layer.id: round(layer.trim, 3) for layer in self._active if layer.trim != 1.0},
+            "wasted_spawns": self.wasted_spawns,
+            "stalls": self.stalls,
+            "ffmpeg": self.ffmpeg.stats(),
+        }
 
-        mixed = np.clip(amb_np + music_np, -32768, 32767).astype(np.int16)
-        return mixed.tobytes()
-    
 
 class MixedAudioSource(discord.AudioSource):
     def __init__(self, mixer: MixedAudio):
         self.mixer = mixer
+        self._attached = False      # read() has run since the last attach()
+
+    def attach(self):
+        """Call before vc.play(): discord.py only creates its encoder if is_opus() is False then."""
+        self._attached = False
 
     def read(self):
-        return self.mixer.read()
+        # discord's Opus encoder needs a real bytes object, so copy out at the boundary
+        frame = bytes(self.mixer.read())
+        self._attached = True
+        return frame
 
     def is_opus(self):
-        return False  # We’re providing raw PCM
+        # discord.py asks right after each read(), so answer for that frame
+        return self._attached and self.mixer.last_frame_opus
@@ -3,7 +3,8 @@
 import asyncio, discord, os, time
 from discord.ext import commands
 
-from bot import IPCBridge, PlaybackManager, StateManager, ConfigManager, MixedAudio, MixedAudioSource, QueueManager, ContentManager, ControlManager, DisplayManager
+from bot import IPCBridge, PlaybackManager, StateManager, ConfigManager, MixedAudio, MixedAudioSource, QueueManager, ContentManager, ControlManager, DisplayManager, AmbienceLoopCache, TrackCache, Checkpointer
+from bot.media_cache import TRACK_CACHE_MB
 
 
 class BotCore:
@@ -28,6 +29,8 @@ class BotCore:
         # ---------- AUDIO MANAGERS ----------
         self.mixer = MixedAudio()
         self.audioSource = MixedAudioSource(self.mixer)
+        self.ambience_cache = AmbienceLoopCache()
+        self.track_cache = TrackCache() if TRACK_CACHE_MB > 0 else None   # opt-in
 
         # ---------- QUEUE MANAGER ----------
         self.queue = QueueManager()
@@ -45,6 +48,9 @@ class BotCore:
         # ---------- BOT CONTROL MANAGER ----------
         self.control = ControlManager(self)
 
+        # ---------- CHECKPOINTS ----------
+        self.checkpoint = Checkpointer(self)
+
         # ---------- INTERNAL FLAGS ----------
         self._ready_event_fired = False
         self.ready = False
@@ -91,6 +97,9 @@ class BotCore:
         
         self.state.bot_online = "online"
 
+        # Pick up the queue and playback from before the last restart
+        await self.checkpoint.restore()
+
 
     # =====================================================
     # CONFIG MANAGEMENT
@@ -0,0 +1,297 @@
+# bot/checkpoint.py
+
+import asyncio, json, os, struct, zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from .audiomixer import MUSIC_LAYER
+
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", os.path.join(os.getcwd(), "data", "checkpoint.bin"))
+CHECKPOINT_INTERVAL_S = float(os.getenv("CHECKPOINT_INTERVAL_S", "2"))          # playback state sampling
+CHECKPOINT_COMPACT_RECORDS = int(os.getenv("CHECKPOINT_COMPACT_RECORDS", "500")) # log length before a rewrite
+
+MAGIC = b"AMCK1\n"
+RECORD = struct.Struct("<BII")      # kind, payload length, crc32(payload); payload is zlib-compressed
+KIND_QUEUE, KIND_OP, KIND_STATE = 1, 2, 3
+
+FULL_OPS = {"load", "shuffle"}      # queue changes that cannot be replayed from their op
+
+
+def _encode_queue(dump):
+    """Queue dump → bytes: length-prefixed JSON meta, then the orders as int32 arrays."""
+    base = array("i", dump["base"])
+    order = array("i", dump["order"]) if dump["order"] is not None else None
+    meta = {k: v for k, v in dump.items() if k not in ("base", "order")}
+    meta["base_len"] = len(base)
+    meta["order_len"] = len(order) if order is not None else None
+    meta = json.dumps(meta, separators=(",", ":")).encode()
+    return struct.pack("<I", len(meta)) + meta + base.tobytes() + (order.tobytes() if order else b"")
+
+
+def _decode_queue(body):
+    (meta_len,) = struct.unpack_from("<I", body)
+    meta = json.loads(body[4:4 + meta_len])
+    offset = 4 + meta_len
+
+    base = array("i")
+    base.frombytes(body[offset:offset + meta["base_len"] * base.itemsize])
+    offset += len(base) * base.itemsize
+
+    order = None
+    if meta["order_len"] is not None:
+        order = array("i")
+        order.frombytes(body[offset:offset + meta["order_len"] * order.itemsize])
+
+    meta["base"], meta["order"] = base, order
+    return meta
+
+
+def read_checkpoint(path):
+    """
+    Decoded records of a checkpoint log, oldest first, as (kind, value).
+    Reading stops at the first torn or corrupt record (a write cut short by a crash).
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+
+    if not data.startswith(MAGIC):
+        print("[CHECKPOINT] Unrecognised checkpoint file; ignoring it")
+        return []
+
+    records = []
+    offset = len(MAGIC)
+    while offset + RECORD.size <= len(data):
+        kind, length, crc = RECORD.unpack_from(data, offset)
+        payload = data[offset + RECORD.size:offset + RECORD.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            print(f"[CHECKPOINT] Dropping damaged tail at byte {offset}")
+            break
+
+        body = zlib.decompress(payload)
+        records.append((kind, _decode_queue(body) if kind == KIND_QUEUE else json.loads(body)))
+        offset += RECORD.size + length
+    return records
+
+
+class Checkpointer:
+    """
+    Crash-safe record of the queue and playback state, so a restart resumes where it left off.
+    - An append log: full queue dumps on load/shuffle, one small op record per other queue
+      change (QueueManager.journal), and a playback state record whenever it changes.
+    - Every CHECKPOINT_COMPACT_RECORDS records the log is rewritten as one dump + one state.
+    - Encoding and file I/O run in order on a single writer thread, off the event loop.
+    """
+    def __init__(self, core, path=CHECKPOINT_PATH):
+        self.core = core
+        self.path = path
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._file = None               # append handle, owned by the writer thread
+        self._task = None
+        self._last_state = None
+
+        self.records = 0                # since the last compaction
+        self.compactions = 0
+        self.restored = False
+
+    # =====================================================================
+    # RECORDING
+    # =====================================================================
+    def record(self, op, *args):
+        """QueueManager journal hook."""
+        if op in FULL_OPS:
+            dump = self.core.queue.dump()
+            self._submit(lambda: self._append(KIND_QUEUE, _encode_queue(dump)))
+        else:
+            body = json.dumps([op, *args], separators=(",", ":")).encode()
+            self._submit(lambda: self._append(KIND_OP, body))
+        self.records += 1
+
+    def compact(self):
+        dump = self.core.queue.dump()
+        state = self.capture_state()
+        self._last_state = state
+        self.records = 0
+        self.compactions += 1
+        self._submit(lambda: self._rewrite([
+            (KIND_QUEUE, _encode_queue(dump)),
+            (KIND_STATE, json.dumps(state).encode()),
+        ]))
+
+    def capture_state(self):
+        state = self.core.state
+        return {
+            "in_vc": state.in_vc,
+            "music": {
+                "playing": state.is_music_playing,
+                "volume": state.music_volume,
+                "position": round(self.core.mixer.position(MUSIC_LAYER), 1),
+            },
+            "shuffle": state.shuffle_mode,
+            "ambience": {
+                layer_id: {k: layer[k] for k in ("name", "url", "volume", "playing")}
+                for layer_id, layer in state.ambience_layers.items()
+            },
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL_S)
+            try:
+                if self.records >= CHECKPOINT_COMPACT_RECORDS:
+                    self.compact()
+                    continue
+
+                state = self.capture_state()
+                if state != self._last_state:
+                    self._last_state = state
+                    body = json.dumps(state).encode()
+                    self._submit(lambda: self._append(KIND_STATE, body))
+                    self.records += 1
+            except Exception as e:
+                print(f"[CHECKPOINT] State capture failed: {e}")
+
+    # ===== Writer thread =====
+    def _submit(self, job):
+        self._writer.submit(self._guarded, job)
+
+    def _guarded(self, job):
+        try:
+            job()
+        except Exception as e:
+            print(f"[CHECKPOINT] Write failed: {e}")
+
+    def _append(self, kind, body):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        payload = zlib.compress(body)
+        # A process crash keeps whatever reached the OS; a torn last record is dropped on read
+        self._file.write(RECORD.pack(kind, len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+
+    def _rewrite(self, records):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            for kind, body in records:
+                payload = zlib.compress(body)
+                f.write(RECORD.pack(kind, len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "ab")
+
+    # =====================================================================
+    # RESTORE
+    # =====================================================================
+    async def restore(self):
+        """
+        Rebuild the queue from the log, start recording, and resume playback from
+        the last state. Called once, when Discord is ready.
+        """
+        if self.restored:
+            return
+        self.restored = True
+
+        queue = self.core.queue
+        saved = None
+        try:
+            records = await asyncio.to_thread(read_checkpoint, self.path)
+            for kind, value in records:
+                if kind == KIND_QUEUE:
+                    queue.restore(value)
+                elif kind == KIND_OP:
+                    self._replay(value)
+                elif kind == KIND_STATE:
+                    saved = value
+            if records:
+                print(f"[CHECKPOINT] Restored {len(queue.tracks)} queued tracks from {len(records)} records")
+        except Exception as e:
+            print(f"[CHECKPOINT] Could not restore checkpoint: {e}")
+
+        queue.journal = self.record
+        self.compact()  # fresh log (also drops any damaged tail)
+        self._task = asyncio.create_task(self._run())
+
+        if saved:
+            await self._resume(saved)
+
+    def _replay(self, value):
+        op, *args = value
+        queue = self.core.queue
+        handler = {
+            "next": queue.next_track,
+            "previous": queue.previous_track,
+            "loop": queue.toggle_loop_current,
+            "unshuffle": queue.unshuffle,
+            "insert": queue.insert,
+            "remove": queue.remove,
+            "move": queue.move,
+        }[op]
+        handler(*args)
+
+    async def _resume(self, saved):
+        core = self.core
+        state = core.state
+        playback = core.playback
+        queue = core.queue
+
+        # State first, so the joins and starts below pick up the saved volumes
+        music = saved["music"]
+        state.music_volume = music["volume"]
+        state.shuffle_mode = saved["shuffle"]
+        state.loop_mode = queue.loop_current
+        state.playlist_name = queue.playlist_name
+        state.playlist = list(queue.tracks)
+        current = queue.get_current()
+        state.playlist_current = current or {"url": None, "name": "None"}
+
+        for layer_id, layer in saved["ambience"].items():
+            state.ambience_layer(layer_id)["volume"] = layer["volume"]
+            state.set_ambience(layer["name"], layer["url"], layer_id)
+
+        vc_id = core.botConfig.data.get("voice_channel_id")
+        if not saved["in_vc"] or not vc_id:
+            await playback.send_state()
+            return
+
+        # Resolve while the voice connection comes up; the starts below join these flights.
+        # Only a check of the ambience cache: play_ambience does the counted lookup.
+        urls = [current["url"]] if music["playing"] and current else []
+        urls += [
+            layer["url"] for layer in saved["ambience"].values()
+            if layer["playing"] and layer["url"] and not core.ambience_cache.lookup(layer["url"], touch=False)
+        ]
+        resolves = [asyncio.create_task(playback.resolver.resolve(url)) for url in urls]
+
+        try:
+            await playback.join_vc(vc_id)
+            if not state.voice_client:
+                return
+
+            starts = [
+                playback.play_ambience(layer["url"], layer["name"], layer_id)
+                for layer_id, layer in saved["ambience"].items() if layer["playing"] and layer["url"]
+            ]
+            if music["playing"] and current:
+                starts.append(playback.play_music(offset=music["position"]))
+            await asyncio.gather(*starts)
+
+            print(f"[CHECKPOINT] Resumed playback ({len(starts)} layer(s))")
+            await core.display.update_queue_display()
+        finally:
+            # Hold on to the resolves until they land (and collect their errors)
+            await asyncio.gather(*resolves, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "records": self.records,
+            "compactions": self.compactions,
+            "restored": self.restored,
+        }
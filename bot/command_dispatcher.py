@@ -82,24 +82,72 @@ class CommandDispatcher:
         return self.success("SET_VOLUME_MUSIC")
 
     async def cmd_pause(self, args):
-        await self.core.playback.pause(args.get("type"))
+        await self.core.playback.pause(args.get("type"), args.get("layer"))
         return self.success("PAUSE")
 
     async def cmd_resume(self, args):
-        await self.core.playback.resume(args.get("type"))
+        await self.core.playback.resume(args.get("type"), args.get("layer"))
         return self.success("RESUME")
 
+    async def cmd_seek(self, args):
+        position = float(args.get("position", 0))
+        if not await self.core.playback.seek(position, args.get("type", "music"), args.get("layer")):
+            return self.fail("SEEK", "Nothing to seek")
+        return self.success("SEEK", {"position": position})
+
     async def cmd_play_ambience(self, args):
         url = args.get("url")
         title = args.get("title")
-        await self.core.playback.play_ambience(url, title)
+        await self.core.playback.play_ambience(url, title, args.get("layer"))
         return self.success("PLAY_AMBIENCE")
 
+    async def cmd_stop_ambience(self, args):
+        await self.core.playback.stop_ambience(args.get("layer"))
+        return self.success("STOP_AMBIENCE")
+
     async def cmd_set_volume_ambience(self, args):
         vol = args.get("volume")
-        await self.core.playback.set_volume("ambience", int(vol))
+        await self.core.playback.set_volume("ambience", int(vol), args.get("layer"))
         return self.success("SET_VOLUME_AMBIENCE")
 
+    async def cmd_set_mixer_engine(self, args):
+        self.core.mixer.set_engine(args.get("engine"))
+        return self.success("SET_MIXER_ENGINE", {"engine": self.core.mixer.engine})
+
+    # ---------- Queue ----------
+    async def cmd_get_queue(self, args):
+        queue = self.core.queue
+        since = args.get("since_version")
+        if since is not None and str(since) == queue.version:
+            return self.success("QUEUE_DATA", {"version": queue.version, "unchanged": True})
+
+        return self.success("QUEUE_DATA", queue.snapshot(
+            int(args.get("page", 1)), int(args.get("per_page", self.core.display.per_page))
+        ))
+
+    async def cmd_queue_insert(self, args):
+        tracks = args.get("tracks")
+        if tracks is None and args.get("url"):
+            tracks = [{"url": args["url"], "name": args.get("name") or args["url"]}]
+        if not tracks:
+            return self.fail("QUEUE_INSERT", "No tracks given")
+
+        tracks = [{"url": t["url"], "name": t.get("name") or t["url"]} for t in tracks]
+        changed = await self.core.playback.queue_insert(tracks, args.get("position"))
+        return self.success("QUEUE_INSERT", changed)
+
+    async def cmd_queue_remove(self, args):
+        changed = await self.core.playback.queue_remove(args.get("position", -1))
+        if changed is None:
+            return self.fail("QUEUE_REMOVE", "Position out of range")
+        return self.success("QUEUE_REMOVE", changed)
+
+    async def cmd_queue_move(self, args):
+        changed = await self.core.playback.queue_move(args.get("from", -1), args.get("to", -1))
+        if changed is None:
+            return self.fail("QUEUE_MOVE", "Position out of range")
+        return self.success("QUEUE_MOVE", changed)
+
     # ---------- Voice ----------
     async def cmd_joinvc(self, args):
         vc_id = self.core.botConfig.data.get("voice_channel_id")
@@ -197,10 +245,18 @@ class CommandDispatcher:
         "SET_VOLUME_MUSIC":       cmd_set_volume_music,         # Online only command
 
         "PLAY_AMBIENCE":          cmd_play_ambience,            # Online only command
+        "STOP_AMBIENCE":          cmd_stop_ambience,            # Online only command
         "SET_VOLUME_AMBIENCE":    cmd_set_volume_ambience,      # Online only command
+        "SET_MIXER_ENGINE":       cmd_set_mixer_engine,         # Online only command
 
         "PAUSE":                  cmd_pause,                    # Online only command
         "RESUME":                 cmd_resume,                   # Online only command
+        "SEEK":                   cmd_seek,                     # Online only command
+
+        "GET_QUEUE":              cmd_get_queue,
+        "QUEUE_INSERT":           cmd_queue_insert,             # Online only command
+        "QUEUE_REMOVE":           cmd_queue_remove,             # Online only command
+        "QUEUE_MOVE":             cmd_queue_move,               # Online only command
 
         "JOINVC":                 cmd_joinvc,                   # Online only command
         "LEAVEVC":                cmd_leavevc,                  # Online only command
@@ -1,20 +1,52 @@
 # bot/content_manager.py
 
-import os
+import os, time
 
 from config import load_json, save_json
 
 
+class FrozenDict(dict):
+    """
+    Read-only dict handed out by ContentManager. Every caller shares the cached
+    copy, so mutating methods raise; copy() gives a plain dict to edit.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("content is read-only; save changes through ContentManager")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def copy(self):
+        return dict(self)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
 class ContentManager:
     """
     Loads and saves user playlists + ambience libraries.
     This is the persistent library separate from the active queue.
+    - Each file is parsed once and kept in memory as FrozenDicts.
+    - A cached file is re-read only when its mtime/size changes (edited by hand);
+      our own saves replace the cached copy directly.
     """
 
     def __init__(self, base_dir):
         self.playlist_file = os.path.join(base_dir, "data/playlists.json")
         self.ambience_file = os.path.join(base_dir, "data/ambience.json")
 
+        self._cache = {}            # path → (FrozenDict, (mtime_ns, size))
+        self.hits = 0
+        self.parses = 0
+        self.parse_ms = 0.0         # total time spent parsing + freezing
+        self.last_parse_ms = 0.0
+
         # Auto-create empty files if missing
         self._ensure_file(self.playlist_file)
         self._ensure_file(self.ambience_file)
@@ -32,16 +64,54 @@ class ContentManager:
     def playlist_to_tracklist(self, playlist_dict):
         return [{"url": u, "name": t} for u, t in playlist_dict.items()]
 
+    def _signature(self, path):
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, path):
+        """Cached contents of a JSON file, re-parsed only if it changed on disk."""
+        cached = self._cache.get(path)
+        try:
+            signature = self._signature(path)
+        except FileNotFoundError:
+            signature = None
+
+        if cached and cached[1] == signature:
+            self.hits += 1
+            return cached[0]
+
+        started = time.perf_counter()
+        data = _freeze(load_json(path, default_data={}))
+        self.last_parse_ms = (time.perf_counter() - started) * 1000
+        self.parse_ms += self.last_parse_ms
+        self.parses += 1
+
+        self._cache[path] = (data, signature)
+        print(f"[CONTENT] Loaded {os.path.basename(path)} ({self.last_parse_ms:.1f}ms)")
+        return data
+
+    def _store(self, path, data):
+        """Write a file and make the written data the cached copy."""
+        save_json(path, data)
+        self._cache[path] = (_freeze(data), self._signature(path))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "parses": self.parses,
+            "parse_ms": round(self.parse_ms, 1),
+            "last_parse_ms": round(self.last_parse_ms, 1),
+        }
+
     # =====================================================================
     # PLAYLIST ACCESS
     # =====================================================================
     def get_playlists(self):
-        """Return dict: {playlistName: {url: title, ...}}"""
-        playlists = load_json(self.playlist_file, default_data={})
-        return playlists
+        """Return read-only dict: {playlistName: {url: title, ...}}"""
+        return self._load(self.playlist_file)
 
     def get_playlist(self, name):
-        """Return a single playlist dict or None."""
+        """Return a single (read-only) playlist dict or None."""
         playlists = self.get_playlists()
         return playlists.get(name)
 
@@ -49,9 +119,9 @@ class ContentManager:
         """
         Save a playlist (dict of url → title).
         """
-        playlists = load_json(self.playlist_file, default_data={})
+        playlists = self.get_playlists().copy()
         playlists[name] = playlist_data
-        save_json(self.playlist_file, playlists)
+        self._store(self.playlist_file, playlists)
 
         print(f"[CONTENT] Saved playlist '{name}' ({len(playlist_data)} tracks)")
 
@@ -60,8 +130,8 @@ class ContentManager:
     # AMBIENCE ACCESS
     # =====================================================================
     def get_ambience(self):
-        """Return ambience dict."""
-        return load_json(self.ambience_file, default_data={})
+        """Return read-only ambience dict."""
+        return self._load(self.ambience_file)
 
     async def save_ambience(self, ambience_dict):
         """Save ambience (dict of ambienceName → url)."""
@@ -69,5 +139,5 @@ class ContentManager:
             print("[CONTENT] Invalid ambience save request")
             return
 
-        save_json(self.ambience_file, ambience_dict)
+        self._store(self.ambience_file, ambience_dict)
         print(f"[CONTENT] Saved ambience list ({len(ambience_dict)} entries)")        
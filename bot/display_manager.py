@@ -18,6 +18,8 @@ class DisplayManager:
         self.page = 1               # default queue page
         self.per_page = 10
         self.lock = asyncio.Lock()  # ensure no double-writes
+        self.shown = None           # (queue version, page, message id) last put on screen
+        self.skipped = 0            # refreshes that found nothing new to show
 
     # ======================================================================
     # CHANNEL RESOLUTION
@@ -98,13 +100,19 @@ class DisplayManager:
                 print("[DISPLAY] Bot not ready — cannot update queue yet.")
                 return
 
-            # --- build new embed using queue snapshot ---
-            queue_state = self.core.queue.export()
-            embed = render_queue_embed(queue_state, page=self.page, per_page=self.per_page)
-            
             cfg = self.core.botConfig
             text_id = cfg.get_int("text_channel_id")
             msg_id = cfg.get_int("queue_message_id")
+
+            # Same queue version on the same page is already on screen
+            queue = self.core.queue
+            shown = (queue.version, self.page, msg_id)
+            if msg_id and shown == self.shown:
+                self.skipped += 1
+                return
+
+            # --- build new embed using queue snapshot ---
+            embed = render_queue_embed(queue.snapshot(self.page, self.per_page))
             
             if not text_id:
                 print("[DISPLAY] No text_channel_id in config -- Cannot display queue.")
@@ -118,6 +126,7 @@ class DisplayManager:
                 )
                 
                 if edited:
+                    self.shown = shown
                     print("[DISPLAY] Queue message edited")
                     return
                 else:
@@ -131,6 +140,7 @@ class DisplayManager:
             
             if new_msg:
                 self.core.botConfig.save("queue_message_id", new_msg.id)
+                self.shown = (queue.version, self.page, new_msg.id)
                 print("[DISPLAY] Queue message created")
 
 
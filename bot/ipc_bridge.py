@@ -35,6 +35,9 @@ class IPCBridge:
         # long-lived supervisor
         self._supervisor_task: asyncio.Task | None = None
 
+        # in-flight command handlers (kept so they aren't garbage collected mid-run)
+        self._command_tasks: set[asyncio.Task] = set()
+
         # send queue
         self._outbound = asyncio.Queue(maxsize=outbound_capacity)
 
@@ -303,11 +306,24 @@ class IPCBridge:
             await self.send({"type": "heartbeat_ack", "ts": time.time()})
             return
 
-        # Commands
+        # Commands run in their own task so a slow one (e.g. a skip waiting on a
+        # stream resolve) doesn't stop us reading the command that supersedes it.
+        # Tasks start in arrival order, so queue changes made before a handler's
+        # first await still apply in order.
         if cmd:
             print(f"[IPC] Received command: {cmd}")
-            result = await self.dispatcher.handle(data)
-            await self.send(result)
+            task = asyncio.create_task(self._run_command(data), name=f"ipc-cmd-{cmd}")
+            self._command_tasks.add(task)
+            task.add_done_callback(self._command_tasks.discard)
             return
 
-        print("[IPC] Ignoring unrecognized message:", data)
\ No newline at end of file
+        print("[IPC] Ignoring unrecognized message:", data)
+
+    async def _run_command(self, data: dict):
+        try:
+            result = await self.dispatcher.handle(data)
+            await self.send(result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[IPC] Command {data.get('command')} failed:", e)
\ No newline at end of file
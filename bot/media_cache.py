@@ -0,0 +1,367 @@
+# bot/media_cache.py
+
+import asyncio, hashlib, json, os, time
+
+from config import load_json
+from .stream_resolver import YOUTUBE_ID, canonical_url
+
+AMBIENCE_CACHE_DIR = os.getenv("AMBIENCE_CACHE_DIR", os.path.join(os.getcwd(), "data", "cache", "ambience"))
+AMBIENCE_CACHE_MB = int(os.getenv("AMBIENCE_CACHE_MB", "512"))
+AMBIENCE_MAX_CLIP_S = int(os.getenv("AMBIENCE_MAX_CLIP_S", "1800"))
+
+TRACK_CACHE_DIR = os.getenv("TRACK_CACHE_DIR", os.path.join(os.getcwd(), "data", "cache", "tracks"))
+TRACK_CACHE_MB = int(os.getenv("TRACK_CACHE_MB", "0"))             # 0 = track cache off (opt-in)
+TRACK_CACHE_MAX_S = int(os.getenv("TRACK_CACHE_MAX_S", "1200"))    # longer tracks (mixes) are not kept
+TRACK_CACHE_BITRATE = os.getenv("TRACK_CACHE_BITRATE", "128k")     # for sources that are not Opus already
+
+
+class MediaCache:
+    """
+    A directory of cached media files under an LRU disk budget.
+    - Entries are keyed by a string (e.g. a source URL) and stored under a hashed filename.
+    - index.json records size and last use, so eviction order survives restarts.
+      It is replaced atomically; an unreadable one is treated as empty.
+    """
+    def __init__(self, directory, budget_bytes, suffix=""):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self.suffix = suffix
+        self.index_path = os.path.join(directory, "index.json")
+
+        os.makedirs(directory, exist_ok=True)
+        try:
+            self.index = load_json(self.index_path, default_data={})
+        except Exception as e:
+            # e.g. torn by a crash before writes were atomic; cached files get fetched again
+            print(f"[CACHE] Ignoring unreadable index {self.index_path}: {e}")
+            self.index = {}
+        self._drop_missing()
+
+        self.hits = 0
+        self.misses = 0
+
+    # =====================================================================
+    # INTERNAL HELPERS
+    # =====================================================================
+    def path_for(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def _save_index(self):
+        # Temp file + rename, so a crash mid-write leaves the previous index intact
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+    def _drop_missing(self):
+        """Forget index entries whose file was removed behind our back."""
+        stale = [k for k, e in self.index.items() if not os.path.exists(self.path_for(k))]
+        for key in stale:
+            del self.index[key]
+        if stale:
+            self._save_index()
+
+    def _evict(self, keep=None):
+        """Delete least-recently-used entries until the cache fits its budget."""
+        total = self.total_bytes()
+        by_age = sorted(self.index.items(), key=lambda kv: kv[1]["last_used"])
+
+        for key, entry in by_age:
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del self.index[key]
+            print(f"[CACHE] Evicted {key} ({entry['size'] // 1024} KiB)")
+
+    # =====================================================================
+    # PUBLIC API
+    # =====================================================================
+    def lookup(self, key, touch=True):
+        """
+        Return the cached file path for key, or None. With `touch` the lookup counts
+        as a hit/miss and marks the entry recently used; without, it only checks.
+        """
+        entry = self.index.get(key)
+        path = self.path_for(key)
+
+        if entry is None or not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            if entry is not None:
+                del self.index[key]
+                self._save_index()
+            if touch:
+                self.misses += 1
+            return None
+
+        if touch:
+            self.touch(key)
+        return path
+
+    def touch(self, key):
+        """Count a hit on key and mark it recently used."""
+        self.index[key]["last_used"] = time.time()
+        self._save_index()
+        self.hits += 1
+
+    def commit(self, key, tmp_path, **meta):
+        """Move a finished temp file into the cache under key, then enforce the budget."""
+        path = self.path_for(key)
+        os.replace(tmp_path, path)
+
+        self.index[key] = {"size": os.path.getsize(path), "last_used": time.time(), **meta}
+        self._evict(keep=key)
+        self._save_index()
+        return path
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def stats(self):
+        return {
+            "entries": len(self.index),
+            "bytes": self.total_bytes(),
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class AmbienceLoopCache(MediaCache):
+    """
+    Ambience clips decoded once to raw 48 kHz s16le stereo, so the mixer can
+    loop them from an mmap with no ffmpeg process or network connection.
+    """
+    def __init__(self, directory=AMBIENCE_CACHE_DIR, budget_mb=AMBIENCE_CACHE_MB,
+                 max_clip_s=AMBIENCE_MAX_CLIP_S):
+        super().__init__(directory, budget_mb * 1024 * 1024, suffix=".pcm")
+        self.max_clip_s = max_clip_s
+        self._decoding = {}     # key → asyncio.Task
+
+    def decode_in_background(self, key, stream_url):
+        """Start decoding key's stream to the cache unless a decode is already running."""
+        task = self._decoding.get(key)
+        if task and not task.done():
+            return task
+
+        task = asyncio.create_task(self._decode(key, stream_url))
+        self._decoding[key] = task
+        task.add_done_callback(lambda _: self._decoding.pop(key, None))
+        return task
+
+    async def _decode(self, key, stream_url):
+        tmp_path = self.path_for(key) + ".part"
+        proc = None
+        cmd = [
+            "ffmpeg", "-y",
+            "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5",
+            "-i", stream_url,
+            "-t", str(self.max_clip_s),
+            "-f", "s16le", "-ar", "48000", "-ac", "2",
+            "-loglevel", "error",
+            tmp_path,
+        ]
+
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+            )
+            _, err = await proc.communicate()
+
+            size = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+            if proc.returncode != 0 or size == 0:
+                print(f"[CACHE] Ambience decode failed for {key}: {err.decode(errors='ignore')[-200:]}")
+                return None
+
+            # Hitting the cap means the clip is longer than we are willing to loop locally
+            if size >= self.max_clip_s * 48000 * 4 or size > self.budget_bytes:
+                print(f"[CACHE] Ambience {key} is too long to cache ({size // (1024 * 1024)} MiB)")
+                return None
+
+            path = self.commit(key, tmp_path)
+            print(f"[CACHE] Cached ambience {key} ({size // 1024} KiB)")
+            return path
+
+        except asyncio.CancelledError:
+            if proc and proc.returncode is None:
+                proc.kill()
+            raise
+
+        except Exception as e:
+            print(f"[CACHE] Ambience decode error for {key}: {e}")
+            return None
+
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def track_key(url):
+    """One cache key per video: the YouTube id, or the canonical URL for anything else."""
+    match = YOUTUBE_ID.search(url or "")
+    return match.group(1) if match else canonical_url(url)
+
+
+class TrackCache(MediaCache):
+    """
+    Played music tracks kept locally as Ogg/Opus, so replays skip yt-dlp and the network.
+    - Opus sources are remuxed as-is; anything else is encoded at TRACK_CACHE_BITRATE.
+    - A finished file is probed before it is committed: its duration has to match the track's.
+    - lookup() also checks the Ogg signature, on top of the size check every MediaCache does.
+    """
+    def __init__(self, directory=TRACK_CACHE_DIR, budget_mb=TRACK_CACHE_MB, max_track_s=TRACK_CACHE_MAX_S):
+        super().__init__(directory, budget_mb * 1024 * 1024, suffix=".ogg")
+        self.max_track_s = max_track_s
+        self._storing = {}      # key → asyncio.Task
+        self._slot = asyncio.Semaphore(1)
+
+        self.bytes_saved = 0    # local bytes played instead of streamed
+        self.rejected = 0       # failed the integrity check
+
+    # =====================================================================
+    # PLAYBACK SIDE
+    # =====================================================================
+    def local_stream(self, url):
+        """
+        Stream info for a cached track ({"url": path, ...}), or None. Only a check:
+        seeks, resumes and standby preparation look tracks up again, so plays are
+        counted separately by count_start().
+        """
+        key = track_key(url)
+        path = self.lookup(key, touch=False)
+        if path and not self._looks_intact(path):
+            self._discard(key)
+            path = None
+        if not path:
+            return None
+
+        entry = self.index[key]
+        return {"url": path, "acodec": "opus", "duration": entry.get("duration"), "local": True}
+
+    def count_start(self, url, stream):
+        """A track started playing from `stream`: count a hit (and the bytes saved) or a miss."""
+        key = track_key(url)
+        if stream.get("local") and key in self.index:
+            self.touch(key)
+            self.bytes_saved += self.index[key]["size"]
+        else:
+            self.misses += 1
+
+    def peek(self, url):
+        """Path of a cached track without touching its LRU position or the stats."""
+        key = track_key(url)
+        return self.path_for(key) if key in self.index else None
+
+    def _looks_intact(self, path):
+        try:
+            with open(path, "rb") as f:
+                return f.read(4) == b"OggS"
+        except OSError:
+            return False
+
+    def _discard(self, key):
+        self.index.pop(key, None)
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+        self._save_index()
+        self.rejected += 1
+
+    # =====================================================================
+    # STORING
+    # =====================================================================
+    def store_in_background(self, url, stream):
+        """Fetch and keep a track that was just played from the network (if it qualifies)."""
+        key = track_key(url)
+        duration = stream.get("duration")
+        if stream.get("local") or key in self.index or not duration or duration > self.max_track_s:
+            return None
+
+        task = self._storing.get(key)
+        if task and not task.done():
+            return task
+
+        task = asyncio.create_task(self._store(key, stream))
+        self._storing[key] = task
+        task.add_done_callback(lambda _: self._storing.pop(key, None))
+        return task
+
+    async def _store(self, key, stream):
+        async with self._slot:
+            tmp_path = self.path_for(key) + ".part"
+            proc = None
+            codec = ["-c:a", "copy"] if stream.get("acodec") == "opus" else ["-c:a", "libopus", "-b:a", TRACK_CACHE_BITRATE]
+            cmd = [
+                "ffmpeg", "-y", "-nostdin",
+                "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5",
+                "-i", stream["url"],
+                "-map", "0:a:0", "-vn", *codec,
+                "-f", "ogg",
+                "-loglevel", "error",
+                tmp_path,
+            ]
+
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+                )
+                _, err = await proc.communicate()
+                if proc.returncode != 0 or not os.path.exists(tmp_path):
+                    print(f"[CACHE] Track download failed for {key}: {err.decode(errors='ignore')[-200:]}")
+                    return None
+
+                probed = await self._probe_duration(tmp_path)
+                expected = stream["duration"]
+                if probed is None or abs(probed - expected) > max(2.0, expected * 0.02):
+                    self.rejected += 1
+                    print(f"[CACHE] Track {key} failed integrity check ({probed}s, expected {expected}s)")
+                    return None
+
+                path = self.commit(key, tmp_path, duration=probed)
+                print(f"[CACHE] Cached track {key} ({os.path.getsize(path) // 1024} KiB)")
+                return path
+
+            except asyncio.CancelledError:
+                if proc and proc.returncode is None:
+                    proc.kill()
+                raise
+
+            except Exception as e:
+                print(f"[CACHE] Track cache error for {key}: {e}")
+                return None
+
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    @staticmethod
+    async def _probe_duration(path):
+        proc = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+        out, _ = await proc.communicate()
+        try:
+            return float(out.decode().strip())
+        except ValueError:
+            return None
+
+    def stats(self):
+        stats = super().stats()
+        lookups = self.hits + self.misses
+        stats.update({
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "bytes_saved": self.bytes_saved,
+            "rejected": self.rejected,
+            "storing": len(self._storing),
+        })
+        return stats
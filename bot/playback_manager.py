@@ -1,6 +1,14 @@
 # bot/playback_manager.py
 
-import asyncio, discord, yt_dlp
+import asyncio, discord, os
+
+from .audiomixer import MUSIC_LAYER, DEFAULT_AMBIENCE_LAYER
+from .stream_resolver import StreamResolver
+from .track_metadata import TrackMetadataStore, LoudnessAnalyzer
+
+PREFETCH_TRACKS = int(os.getenv("PREFETCH_TRACKS", "2"))
+STANDBY_LEAD_S = float(os.getenv("STANDBY_LEAD_S", "15"))   # spawn the next track this long before the end
+PAUSE_TEARDOWN_S = float(os.getenv("PAUSE_TEARDOWN_S", "60"))   # paused longer: stop ffmpeg, respawn on resume
 
 
 class PlaybackManager:
@@ -16,7 +24,27 @@ class PlaybackManager:
     def __init__(self, core):
         self.core = core
 
-        self.monitor_task = None                 # For song auto-advance
+        self.advance_task = None                 # auto-advance after the mixer reports a track end
+        self.resolver = StreamResolver()         # yt-dlp, off the event loop
+        self.metadata = TrackMetadataStore()     # per-track facts (loudness) kept across restarts
+        self.loudness = LoudnessAnalyzer(self.metadata)
+        self.prefetch_task = None                # resolves upcoming tracks ahead of time
+        self.prefetch_key = None                 # (order generation, urls) it is working through
+        self.prefetch_count = PREFETCH_TRACKS
+        self.transition_task = None              # resolve + spawn for the track being started
+        self.superseded = 0                      # transitions cancelled by a newer command
+        self.current_duration = None             # seconds, from yt-dlp (None if unknown)
+        self.standby_track = None                # queue track loaded into the mixer's next slot
+        self.standby_loop = False                # ... as a -stream_loop repeat of the current track
+        self.unloop_timer = None                 # ends a -stream_loop repeat once loop-current is off
+        self.standby_stream = None               # stream info the standby was started from
+        self.standby_timer = None                # asyncio TimerHandle for preparing the standby
+        self.standby_task = None
+        self.announce_task = None                # state push after a gapless advance
+        self.recover_tasks = {}                  # layer id → restart after an ffmpeg stall
+        self.park_timers = {}                    # layer id → TimerHandle for tearing down a long pause
+        self.parked = {}                         # layer id → position its ffmpeg was stopped at
+        self.stall_restarts = 0
 
 
     # =====================================================================
@@ -47,6 +75,7 @@ class PlaybackManager:
             # Connect new VC
             self.core.state.voice_client = await channel.connect()
             self.core.state.in_vc = True
+            self.core.mixer.set_event_callback(self._on_mixer_event, asyncio.get_running_loop())
 
             print(f"[BOT] Connected to VC: {channel.name}")
 
@@ -65,9 +94,17 @@ class PlaybackManager:
         try:
             print("[BOT] Leaving voice channel...")
 
+            # Abandon a track that is still being resolved
+            if self.transition_task and not self.transition_task.done():
+                self.transition_task.cancel()
+
+            # Nothing queued up may advance the queue or spawn ffmpeg once we are gone
+            self._cancel_timers()
+
             # Stop all audio
-            self.core.mixer.stop_music()
-            self.core.mixer.stop_ambience()
+            for layer_id in self.core.mixer.layer_ids():
+                self.core.mixer.stop_layer(layer_id)
+                self._forget_pause(layer_id)
 
             await vc.disconnect(force=True)
 
@@ -103,6 +140,7 @@ class PlaybackManager:
         self.core.state.is_music_playing = False
 
         print(f"[BOT] Playlist loaded: {name} ({len(tracks)} tracks)")
+        self.schedule_prefetch()
         await self.send_state()
         await self.core.display.update_queue_display()
 
@@ -125,6 +163,39 @@ class PlaybackManager:
         else:
             await self.send_state()
 
+    async def seek(self, position: float, track_type: str = "music", layer_id: str = None):
+        """Jump a layer to `position` seconds, keeping the old audio until the new stream is warm."""
+        layer_id = self._layer_for(track_type, layer_id)
+        layer = self.core.mixer.layer(layer_id) if layer_id else None
+        if layer is None or layer.proc is None:
+            print(f"[BOT] Nothing seekable on layer: {layer_id}")
+            return False
+
+        if layer_id == MUSIC_LAYER:
+            if self.transition_task and not self.transition_task.done():
+                return False
+            track = self.core.state.playlist_current
+            url = track.get("url") if track else None
+        else:
+            url = self.core.state.ambience_layers.get(layer_id, {}).get("url")
+
+        # Cached from when the track started, so this is normally instant
+        stream = await self.get_stream_info(url) if url else None
+        if not stream:
+            return False
+
+        duration = stream.get("duration")
+        if duration:
+            position = min(position, max(0.0, duration - 1))
+
+        if not self.core.mixer.seek_layer(layer_id, stream["url"], position):
+            return False
+
+        if layer_id == MUSIC_LAYER:
+            self.schedule_prefetch()  # re-time the standby for the new position
+        await self.send_state()
+        return True
+
     async def toggle_shuffle(self):
         
         self.core.state.shuffle_mode = not self.core.state.shuffle_mode
@@ -135,6 +206,7 @@ class PlaybackManager:
             self.core.queue.unshuffle()
 
         print(f"[BOT] Shuffle mode: {self.core.state.shuffle_mode}")
+        self.schedule_prefetch()
         await self.send_state()
         await self.core.display.update_queue_display()
 
@@ -143,62 +215,248 @@ class PlaybackManager:
         self.core.state.loop_mode = (mode == "current track")
 
         print(f"[BOT] Loop mode: {self.core.state.loop_mode}")
+        self.schedule_prefetch()
         await self.send_state()
         await self.core.display.update_queue_display()
-    
-    async def pause(self, track_type: str):
-        if track_type == "music":
-            self.core.mixer.pause_music()
-            self.core.state.is_music_playing = False
-        elif track_type == "ambience":
-            self.core.mixer.pause_ambience()
-            self.core.state.is_ambience_playing = False
+
+
+    # =====================================================================
+    # QUEUE EDITING
+    # =====================================================================
+    async def queue_insert(self, tracks, position=None):
+        """Insert tracks at a play position, or straight after the current track if None."""
+        queue = self.core.queue
+        if position is None:
+            start = queue.play_next(tracks)
         else:
-            print(f"[BOT] Unknown track type for pause: {track_type}")
+            start = queue.insert(position, tracks)
+
+        print(f"[BOT] Queued {len(tracks)} track(s) at {start + 1}")
+        return await self._queue_changed(start, start + len(tracks))
+
+    async def queue_remove(self, position):
+        """Remove a track; removing the current one moves on to whatever takes its place."""
+        queue = self.core.queue
+        was_current = int(position) == queue.current_index
+        track = queue.remove(position)
+        if track is None:
+            return None
+
+        print(f"[BOT] Removed from queue: {track['name']}")
+        if was_current:
+            await self._replace_removed_current()
+
+        changed = await self._queue_changed(int(position), int(position) + 1)
+        changed["removed"] = track
+        return changed
+
+    async def _replace_removed_current(self):
+        """
+        The current track left the queue: the layer must not keep playing it, or the
+        next end/skip would advance past its successor. Playing or paused stays so.
+        """
+        queue = self.core.queue
+        state = self.core.state
+        layer = self.core.mixer.layer(MUSIC_LAYER)
+        playing = state.is_music_playing
+        paused = MUSIC_LAYER in self.parked or (layer is not None and layer.paused)
+
+        self.core.mixer.stop_layer(MUSIC_LAYER)
+        self.standby_track = None
+        self._forget_pause(MUSIC_LAYER)
+
+        state.is_music_playing = False
+        if queue.is_empty():
+            state.playlist_current = {"url": None, "name": "None"}
             return
+
+        state.playlist_current = queue.get_current()
+        if playing or paused:
+            await self.play_music()
+            if paused and state.is_music_playing:
+                await self.pause("music")
+
+    async def queue_move(self, source, target):
+        if not self.core.queue.move(source, target):
+            return None
+        # Every row between the two positions shifts by one
+        source, target = int(source), int(target)
+        return await self._queue_changed(min(source, target), max(source, target) + 1)
+
+    async def _queue_changed(self, start, stop):
+        """Re-aim prefetch/standby after an edit and describe the changed window."""
+        queue = self.core.queue
+        self.schedule_prefetch()
         await self.send_state()
+        await self.core.display.update_queue_display()
+        return {
+            "start": start,
+            "tracks": queue.window(start, stop),
+            "current_index": queue.current_index,
+            "total": len(queue.tracks),
+        }
 
-    async def resume(self, track_type: str):
+    def _layer_for(self, track_type: str, layer_id: str = None):
+        """
+        Map a command's type (+ optional layer id) onto a mixer layer id.
+        "music" is the queue track; "ambience" is the named (or default) ambience layer.
+        """
         if track_type == "music":
-            self.core.mixer.resume_music()
-            self.core.state.is_music_playing = True
-        elif track_type == "ambience":
-            self.core.mixer.resume_ambience()
-            self.core.state.is_ambience_playing = True
+            return MUSIC_LAYER
+        if track_type == "ambience":
+            return layer_id or DEFAULT_AMBIENCE_LAYER
+        if track_type in self.core.state.ambience_layers:
+            return track_type
+        return None
+
+    def _attach(self, vc):
+        """Start the mixer on a voice client (a new one after every join)."""
+        self.core.audioSource.attach()
+        vc.play(self.core.audioSource)
+
+    def _set_playing(self, layer_id, playing: bool):
+        if layer_id == MUSIC_LAYER:
+            self.core.state.is_music_playing = playing
         else:
+            self.core.state.ambience_layer(layer_id)["playing"] = playing
+
+    async def pause(self, track_type: str, layer_id: str = None):
+        layer_id = self._layer_for(track_type, layer_id)
+        if layer_id is None:
+            print(f"[BOT] Unknown track type for pause: {track_type}")
+            return
+
+        self.core.mixer.pause_layer(layer_id)
+        self._set_playing(layer_id, False)
+
+        # Short pauses just freeze ffmpeg; long ones let go of it entirely
+        self._cancel_park(layer_id)
+        loop = asyncio.get_running_loop()
+        self.park_timers[layer_id] = loop.call_later(PAUSE_TEARDOWN_S, self._park, layer_id)
+
+        await self.send_state()
+
+    async def resume(self, track_type: str, layer_id: str = None):
+        layer_id = self._layer_for(track_type, layer_id)
+        if layer_id is None:
             print(f"[BOT] Unknown track type for resume: {track_type}")
             return
 
+        self._cancel_park(layer_id)
+        if layer_id in self.parked:
+            await self._unpark(layer_id)
+        else:
+            self.core.mixer.resume_layer(layer_id)
+        self._set_playing(layer_id, True)
+
         # If nothing is driving the VC, (re)attach the mixed source
         vc = self.core.state.voice_client
         if vc and not vc.is_playing():
-            vc.play(self.core.audioSource)
+            self._attach(vc)
 
         await self.send_state()
 
 
+    def _cancel_timers(self):
+        """Drop the standby, unloop and park timers (and a standby being prepared)."""
+        for timer in (self.standby_timer, self.unloop_timer, *self.park_timers.values()):
+            if timer:
+                timer.cancel()
+        self.standby_timer = self.unloop_timer = None
+        self.park_timers.clear()
+
+        if self.standby_task and not self.standby_task.done():
+            self.standby_task.cancel()
+        self.standby_track = None
+
+    def _cancel_park(self, layer_id):
+        timer = self.park_timers.pop(layer_id, None)
+        if timer:
+            timer.cancel()
+
+    def _forget_pause(self, layer_id):
+        """The layer's source was replaced or stopped; its pause no longer applies."""
+        self._cancel_park(layer_id)
+        self.parked.pop(layer_id, None)
+
+    def _park(self, layer_id):
+        self.park_timers.pop(layer_id, None)
+        position = self.core.mixer.park_layer(layer_id)
+        if position is None:
+            return
+
+        self.parked[layer_id] = position
+        if layer_id == MUSIC_LAYER:
+            self.standby_track = None  # parking dropped it
+        print(f"[BOT] Paused '{layer_id}' for {PAUSE_TEARDOWN_S:.0f}s; stopped ffmpeg at {position:.1f}s")
+
+    async def _unpark(self, layer_id):
+        """Respawn a parked layer where it stopped. Audio returns once the pre-roll is buffered."""
+        position = self.parked.pop(layer_id)
+        layer = self.core.mixer.layer(layer_id)
+        if layer is None or layer.url is not None:
+            self.core.mixer.resume_layer(layer_id)  # replaced by a new source since
+            return
+
+        if layer_id == MUSIC_LAYER:
+            track = self.core.state.playlist_current
+            url = track.get("url") if track else None
+        else:
+            url = self.core.state.ambience_layers.get(layer_id, {}).get("url")
+
+        # The cache re-resolves by itself if the old stream URL has expired meanwhile
+        stream = await self.get_stream_info(url) if url else None
+        if not stream:
+            print(f"[BOT] Could not resume '{layer_id}'")
+            return
+
+        if layer_id == MUSIC_LAYER:
+            self.core.mixer.start_layer(layer_id, stream["url"], opus=stream["acodec"] == "opus", offset=position)
+            self.schedule_prefetch()
+        else:
+            self.core.mixer.start_layer(layer_id, stream["url"], loop=True)
+
     # =====================================================================
     # VOLUME
     # =====================================================================
-    async def set_volume(self, track_type, volume):
+    async def set_volume(self, track_type, volume, layer_id=None):
         volume = max(0, min(volume, 100)) / 100
 
-        if track_type == "music":
-            self.core.mixer.set_music_volume(volume)
-            self.core.state.music_volume = int(volume * 100)
+        layer_id = self._layer_for(track_type, layer_id)
+        if layer_id is None:
+            print(f"[BOT] Unknown track type for volume: {track_type}")
+            return
 
-        elif track_type == "ambience":
-            self.core.mixer.set_ambience_volume(volume)
-            self.core.state.ambience_volume = int(volume * 100)
+        # Layers that are not playing yet pick the volume up from state when they start
+        self.core.mixer.set_volume(layer_id, volume)
+        if layer_id == MUSIC_LAYER:
+            self.core.state.music_volume = int(volume * 100)
+        else:
+            self.core.state.ambience_layer(layer_id)["volume"] = int(volume * 100)
 
-        print(f"[BOT] {track_type.capitalize()} volume: {int(volume * 100)}%")
+        print(f"[BOT] {layer_id.capitalize()} volume: {int(volume * 100)}%")
         await self.send_state()
 
 
     # =====================================================================
     # INITIALIZE PLAYBACK
     # =====================================================================
-    async def play_music(self):
+    async def play_music(self, offset: float = 0.0):
+        """
+        Start the queue's current track (`offset` seconds in). Each call supersedes any
+        transition that is still resolving or spawning, so a burst of skips only starts the final track.
+        """
+        if self.transition_task and not self.transition_task.done():
+            self.transition_task.cancel()
+            self.superseded += 1
+
+        task = asyncio.create_task(self._transition_to_current(offset))
+        self.transition_task = task
+
+        # If this one gets superseded in turn, the newer command carries on from here
+        await asyncio.wait({task})
+
+    async def _transition_to_current(self, offset=0.0):
         vc = self.core.state.voice_client
         if not vc:
             print("[BOT] VC not connected.")
@@ -213,101 +471,376 @@ class PlaybackManager:
             url = track["url"]
             title = track["name"]
 
-            # Stop existing
-            self.core.mixer.stop_music()
+            # Stop existing (and any standby prepared for it)
+            self.core.mixer.stop_layer(MUSIC_LAYER)
+            self.standby_track = None
+            self._forget_pause(MUSIC_LAYER)
 
-            stream_url = await self.get_stream(url)
-            if not stream_url:
+            stream = await self.get_stream_info(url)
+            if not stream:
                 print(f"[BOT] Failed to stream: {title}")
                 return
 
-            # Start new track
-            self.core.mixer.start_music(stream_url)
+            if self.core.state.voice_client is not vc:
+                print("[BOT] Voice connection changed while resolving; not starting track.")
+                return
 
+            # Looping this track: keep its PCM so every repeat plays from memory
+            capture = (not offset and self.core.queue.loop_current
+                       and self.core.mixer.fits_capture(stream.get("duration")))
+
+            # Start new track (Opus sources can skip decode/encode while playing alone)
+            self.core.mixer.start_layer(
+                MUSIC_LAYER, stream["url"],
+                opus=stream["acodec"] == "opus" and not capture,
+                volume=self.core.state.music_volume / 100,
+                offset=offset,
+                capture=capture,
+                trim=self.loudness.gain_for(url),
+            )
+            self.loudness.analyze_in_background(url, stream["url"])
+
+            # Keep a local copy for next time (opt-in; see TrackCache)
+            if self.core.track_cache:
+                self.core.track_cache.count_start(url, stream)
+                self.core.track_cache.store_in_background(url, stream)
+
+            self.current_duration = stream.get("duration")
             self.core.state.playlist_current = track
             self.core.state.is_music_playing = True
 
             if not vc.is_playing():
-                vc.play(self.core.audioSource)
+                self._attach(vc)
 
             print(f"[BOT] Now playing: {title}")
 
         except Exception as e:
             print(f"[BOT] Error playing music: {e}")
 
-        # Start monitor
-        if self.monitor_task and not self.monitor_task.done():
-            self.monitor_task.cancel()
-
-        self.monitor_task = asyncio.create_task(self._monitor_end())
+        self.schedule_prefetch()
 
         await self.send_state()
     
-    async def play_ambience(self, url, title):
+    async def play_ambience(self, url, title, layer_id=None):
         vc = self.core.state.voice_client
         if not vc:
             print("[BOT] VC not connected.")
             return
 
-        try:
-            self.core.mixer.stop_ambience()
-
-            stream_url = await self.get_stream(url)
-            if not stream_url:
-                print(f"[BOT] Failed ambience stream: {title}")
-                return
-
-            self.core.mixer.start_ambience(stream_url, loop=True)
+        layer_id = layer_id or DEFAULT_AMBIENCE_LAYER
+        if layer_id == MUSIC_LAYER:
+            raise ValueError(f"'{MUSIC_LAYER}' is reserved for the queue")
 
-            self.core.state.ambience_name = title
-            self.core.state.ambience_url = url
-            self.core.state.is_ambience_playing = True
+        try:
+            self.core.mixer.stop_layer(layer_id)
+            self._forget_pause(layer_id)
+            state = self.core.state.ambience_layer(layer_id)
+            cache = self.core.ambience_cache
+
+            cached = cache.lookup(url)
+            if cached:
+                # Decoded before: loop it from disk, no yt-dlp or ffmpeg needed
+                self.core.mixer.start_cached_layer(layer_id, cached, volume=state["volume"] / 100)
+            else:
+                stream_url = await self.get_stream(url)
+                if not stream_url:
+                    print(f"[BOT] Failed ambience stream: {title}")
+                    return
+
+                self.core.mixer.start_layer(layer_id, stream_url, loop=True, volume=state["volume"] / 100)
+
+                # Library entries get decoded once in the background for next time
+                if url in self.core.content.get_ambience().values():
+                    cache.decode_in_background(url, stream_url)
+
+            self.core.state.set_ambience(title, url, layer_id)
+            state["playing"] = True
 
             if not vc.is_playing():
-                vc.play(self.core.audioSource)
+                self._attach(vc)
 
         except Exception as e:
             print(f"[BOT] Failed ambience: {e}")
 
         await self.send_state()
 
+    async def stop_ambience(self, layer_id=None):
+        """Stop an ambience layer and drop it from the mix."""
+        layer_id = layer_id or DEFAULT_AMBIENCE_LAYER
+        if layer_id == MUSIC_LAYER:
+            raise ValueError(f"'{MUSIC_LAYER}' is reserved for the queue")
+
+        self.core.mixer.stop_layer(layer_id)
+        self._forget_pause(layer_id)
+        self.core.state.remove_ambience(layer_id)
+
+        print(f"[BOT] Stopped ambience layer: {layer_id}")
+        await self.send_state()
+
 
     # =====================================================================
     # STREAM RESOLVER
     # =====================================================================
     async def get_stream(self, url):
-        opts = {
-            "format": "bestaudio[ext=webm][acodec=opus]/bestaudio/best",
-            "quiet": True,
-            "noplaylist": True,
-            "default_search": "auto",
-            "skip_download": True,
-        }
-        try:
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                return info.get("url")
-        except Exception:
-            return None
+        stream = await self.get_stream_info(url, local=False)
+        return stream["url"] if stream else None
+
+    async def get_stream_info(self, url, local=True):
+        """
+        Resolve a track URL to {"url": direct stream URL, "acodec": codec name, "duration": s}.
+        With `local`, a copy in the track cache wins (its "url" is then a file path).
+        """
+        if local and self.core.track_cache:
+            stream = self.core.track_cache.local_stream(url)
+            if stream:
+                return stream
+        return await self.resolver.resolve(url)
 
 
     # =====================================================================
-    # SONG MONITOR
+    # PREFETCH
     # =====================================================================
-    async def _monitor_end(self):
-        while True:
-            await asyncio.sleep(1)
+    def schedule_prefetch(self):
+        """
+        (Re)start resolving the next few tracks in play order. A prefetch already
+        running is only cancelled when the order or the tracks it targets changed;
+        cancelling it would also abort resolves that are still wanted.
+        """
+        queue = self.core.queue
+        tracks = queue.upcoming(self.prefetch_count)
+        self.core.mixer.set_repeat(MUSIC_LAYER, queue.loop_current)
+        self._sync_standby(*self._standby_target(tracks))
+        self._sync_unloop()
+
+        key = (queue.order_generation, tuple(track["url"] for track in tracks))
+        running = self.prefetch_task and not self.prefetch_task.done()
+        if running and key == self.prefetch_key:
+            return
+        if running:
+            self.prefetch_task.cancel()
 
-            proc = self.core.mixer.proc_music
-            if proc and proc.poll() is None:
-                continue  # still playing
-            
-            # Once the current song has ended, start the next song by "skipping" the current song since it'd be playing empty audio
-            await self.skip()
-            
-            await self.send_state()
+        self.prefetch_key = key
+        if not tracks:
+            self.prefetch_task = None
+            return
+
+        self.prefetch_task = asyncio.create_task(self._prefetch(tracks, queue.order_generation))
+
+    async def _prefetch(self, tracks, generation):
+        for track in tracks:
+            # Reshuffled or reloaded since we started: a newer prefetch takes over
+            if self.core.queue.order_generation != generation:
+                return
+            # Already on disk: nothing to resolve
+            cache = self.core.track_cache
+            source = cache.peek(track["url"]) if cache else None
+            if source is None:
+                stream = await self.resolver.resolve(track["url"])
+                source = stream["url"] if stream else None
+
+            # Measure loudness while there is time, so the track starts at the right level
+            if source:
+                self.loudness.analyze_in_background(track["url"], source)
+
+
+    # =====================================================================
+    # STANDBY (GAPLESS NEXT TRACK)
+    # =====================================================================
+    def _standby_target(self, upcoming):
+        """
+        What the standby slot should hold, as (track, loop). With loop-current on
+        that is the current track under -stream_loop, unless the mixer already
+        repeats it from captured PCM (or is capturing it to do so).
+        """
+        queue = self.core.queue
+        if queue.loop_current:
+            if self.core.mixer.repeating(MUSIC_LAYER):
+                return None, False
+            return queue.get_current(), True
+        return (upcoming[0] if upcoming else None), False
+
+    def _sync_standby(self, next_track, loop=False):
+        """
+        Keep the mixer's standby slot matched to the next track in play order:
+        drop it if the queue moved on, and (re)arm the timer that prepares it.
+        """
+        if self.standby_timer:
+            self.standby_timer.cancel()
+            self.standby_timer = None
+        if self.standby_task and not self.standby_task.done():
+            self.standby_task.cancel()
+
+        if self.standby_track is not None and (self.standby_track is not next_track or self.standby_loop != loop):
+            self.core.mixer.clear_next(MUSIC_LAYER)
+            self.standby_track = None
+
+        if next_track is not None and self.standby_track is None:
+            self._arm_standby(next_track, loop)
+
+    def _sync_unloop(self):
+        """A track repeating under -stream_loop never ends by itself; end it after this pass."""
+        if self.unloop_timer:
+            self.unloop_timer.cancel()
+            self.unloop_timer = None
+
+        layer = self.core.mixer.layer(MUSIC_LAYER)
+        if self.core.queue.loop_current or layer is None or not layer.loop or not self.current_duration:
+            return
+
+        left = self.current_duration - self.core.mixer.position(MUSIC_LAYER) % self.current_duration
+        self.unloop_timer = asyncio.get_running_loop().call_later(left, self._end_repeat)
+
+    def _end_repeat(self):
+        self.unloop_timer = None
+        if self.transition_task and not self.transition_task.done():
+            return
+        self.advance_task = asyncio.create_task(self._advance())
+
+    def _standby_delay(self):
+        if not self.current_duration:
+            return 0.0  # unknown length: get ready straight away
+        left = self.current_duration - self.core.mixer.position(MUSIC_LAYER)
+        return max(0.0, left - STANDBY_LEAD_S)
+
+    def _arm_standby(self, track, repeat=False):
+        loop = asyncio.get_running_loop()
+        self.standby_timer = loop.call_later(self._standby_delay(), self._standby_due, track, repeat)
+
+    def _standby_due(self, track, repeat):
+        self.standby_timer = None
+
+        # Paused or started late: the end is further away than planned
+        if self._standby_delay() > 0:
+            self._arm_standby(track, repeat)
+            return
+        self.standby_task = asyncio.create_task(self._prepare_standby(track, repeat))
+
+    async def _prepare_standby(self, track, repeat=False):
+        stream = await self.get_stream_info(track["url"])
+        if not stream:
+            return
+
+        target, target_repeat = self._standby_target(self.core.queue.upcoming(1))
+        if target is not track or target_repeat != repeat:
+            return
+        if self.transition_task and not self.transition_task.done():
+            return
+
+        trim = self.loudness.gain_for(track["url"])
+        opus = stream["acodec"] == "opus"
+        if self.core.mixer.prepare_next(MUSIC_LAYER, stream["url"], loop=repeat, trim=trim, opus=opus):
+            self.standby_track = track
+            self.standby_loop = repeat
+            self.standby_stream = stream
+            print(f"[BOT] Standby ready: {track['name']}{' (repeat)' if repeat else ''}")
+
+    def _on_advanced(self):
+        """The mixer swapped the standby in; move the queue along to match."""
+        track, self.standby_track = self.standby_track, None
+        self.core.queue.next_track()
+
+        current = self.core.queue.get_current()
+        if current is not track:
+            # Queue changed without telling us; restart on whatever is current now
+            self.advance_task = asyncio.create_task(self.play_music())
+            return
+
+        self.current_duration = self.standby_stream.get("duration")
+        if self.core.track_cache:
+            self.core.track_cache.count_start(track["url"], self.standby_stream)
+        self.core.state.playlist_current = track
+        print(f"[BOT] Now playing: {track['name']}")
+
+        self.schedule_prefetch()
+        self.announce_task = asyncio.create_task(self._announce_advance())
+
+    async def _announce_advance(self):
+        await self.send_state()
+        await self.core.display.update_queue_display()
+
+
+    # =====================================================================
+    # MIXER EVENTS
+    # =====================================================================
+    def _on_mixer_event(self, layer_id, event):
+        """Called by the mixer (via the event loop) when a layer ends, advances or stalls."""
+        if event == "stalled":
+            self._recover(layer_id)
             return
 
+        if layer_id != MUSIC_LAYER:
+            return
+
+        if event == "advanced":
+            self._on_advanced()
+            return
+        if event == "looped":
+            print("[BOT] Looping the current track from memory")
+            return
+
+        # A skip that is already starting another track wins over the stale end
+        if self.transition_task and not self.transition_task.done():
+            return
+        if not self.core.mixer.layer_finished(MUSIC_LAYER):
+            return
+
+        if self.advance_task and not self.advance_task.done():
+            return
+        self.advance_task = asyncio.create_task(self._advance())
+
+    async def _advance(self):
+        # The song has ended, so start the next one by "skipping" the silent remainder
+        await self.skip()
+        await self.send_state()
+
+    def _recover(self, layer_id):
+        task = self.recover_tasks.get(layer_id)
+        if task and not task.done():
+            return
+        self.recover_tasks[layer_id] = asyncio.create_task(self._restart_stalled(layer_id))
+
+    async def _restart_stalled(self, layer_id):
+        """
+        ffmpeg stopped delivering (expired URL, dead connection): resolve the
+        track again, skipping the cache, and restart it where it stalled.
+        """
+        if layer_id == MUSIC_LAYER:
+            if self.transition_task and not self.transition_task.done():
+                return  # a new track is being started anyway
+            track = self.core.state.playlist_current
+            url = track["url"] if track else None
+        else:
+            url = self.core.state.ambience_layers.get(layer_id, {}).get("url")
+
+        if not url:
+            return
+
+        layer = self.core.mixer.layer(layer_id)
+        stream_before = layer.url if layer else None
+
+        stream = await self.resolver.resolve(url, fresh=True)
+        layer = self.core.mixer.layer(layer_id)
+        if not stream or layer is None or layer.url != stream_before:
+            return  # stopped or replaced while we were resolving
+
+        if layer.loop:
+            self.core.mixer.start_layer(layer_id, stream["url"], loop=True)
+        else:
+            offset = self.core.mixer.position(layer_id)
+            self.core.mixer.start_layer(layer_id, stream["url"], opus=stream["acodec"] == "opus", offset=offset)
+            self.schedule_prefetch()  # the restart dropped any standby
+
+        self.stall_restarts += 1
+        print(f"[BOT] Restarted stalled layer '{layer_id}' at {self.core.mixer.position(layer_id):.1f}s")
+
+
+    def stats(self):
+        return {
+            "superseded_transitions": self.superseded,
+            "stall_restarts": self.stall_restarts,
+            "parked_layers": list(self.parked),
+        }
+
 
     # =====================================================================
     # IPC STATE UPDATES
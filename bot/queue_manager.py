@@ -1,25 +1,198 @@
 # bot/queue_manager.py
 
-import random
+import os, random
+from array import array
+from collections import deque
+
+QUEUE_HISTORY = int(os.getenv("QUEUE_HISTORY", "500"))   # how far "previous" can go back
+ORDER_CHUNK = 512                                         # target entries per IndexedOrder chunk
+
+
+class IndexedOrder:
+    """
+    Sequence of distinct ints (table indices) kept as a rope of array chunks.
+    - A Fenwick tree over chunk lengths finds position → (chunk, offset) in O(log n).
+    - Each value remembers its chunk, so position(value) is O(log n) plus a scan of one chunk.
+    - insert/pop touch one chunk; chunks split past 2 * ORDER_CHUNK and vanish when empty.
+    """
+    def __init__(self, values=()):
+        values = array("l", values)
+        self._chunks = [values[i:i + ORDER_CHUNK] for i in range(0, len(values), ORDER_CHUNK)]
+        self._len = len(values)
+        self._home = {}         # value → chunk holding it
+        for chunk in self._chunks:
+            for value in chunk:
+                self._home[value] = chunk
+        self._reindex()
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __getitem__(self, position):
+        slot, offset = self._locate(self._check(position))
+        return self._chunks[slot][offset]
+
+    # =====================================================================
+    # EDITING
+    # =====================================================================
+    def insert(self, position, value):
+        position = max(0, min(position, self._len))
+        if not self._chunks:
+            self._chunks.append(array("l"))
+            self._reindex()
+
+        slot, offset = self._locate(position)
+        if slot == len(self._chunks):   # appending
+            slot -= 1
+            offset = len(self._chunks[slot])
+
+        chunk = self._chunks[slot]
+        chunk.insert(offset, value)
+        self._home[value] = chunk
+        self._len += 1
+
+        if len(chunk) > 2 * ORDER_CHUNK:
+            half = chunk[ORDER_CHUNK:]
+            del chunk[ORDER_CHUNK:]
+            for moved in half:
+                self._home[moved] = half
+            self._chunks.insert(slot + 1, half)
+            self._reindex()
+        else:
+            self._bump(slot, 1)
+
+    def pop(self, position):
+        slot, offset = self._locate(self._check(position))
+        chunk = self._chunks[slot]
+        value = chunk.pop(offset)
+        del self._home[value]
+        self._len -= 1
+
+        if chunk:
+            self._bump(slot, -1)
+        else:
+            del self._chunks[slot]
+            self._reindex()
+        return value
+
+    def position(self, value):
+        """Index of value in the sequence (KeyError if absent)."""
+        chunk = self._home[value]
+        return self._prefix(self._slots[id(chunk)]) + chunk.index(value)
+
+    # =====================================================================
+    # FENWICK INDEX
+    # =====================================================================
+    def _check(self, position):
+        if position < 0:
+            position += self._len
+        if not 0 <= position < self._len:
+            raise IndexError("queue position out of range")
+        return position
+
+    def _reindex(self):
+        """Rebuild chunk slots and the tree after chunks were added or removed."""
+        self._slots = {id(chunk): slot for slot, chunk in enumerate(self._chunks)}
+        tree = [0] + [len(chunk) for chunk in self._chunks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _bump(self, slot, delta):
+        i = slot + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, slot):
+        """Entries in the chunks before `slot`."""
+        total = 0
+        while slot > 0:
+            total += self._tree[slot]
+            slot -= slot & -slot
+        return total
+
+    def _locate(self, position):
+        """(chunk slot, offset) of a position; slot == len(chunks) means one past the end."""
+        slot = 0
+        step = 1 << (len(self._chunks).bit_length())
+        while step:
+            nxt = slot + step
+            if nxt < len(self._tree) and self._tree[nxt] <= position:
+                slot = nxt
+                position -= self._tree[nxt]
+            step >>= 1
+        return slot, position
+
+
+class PlayOrder:
+    """
+    Read-only sequence view of the queue in play order.
+    - view[i] is the track dict at play position i; len(view) is the track count.
+    - Nothing is copied: it reads through the queue's table and play order.
+    """
+    def __init__(self, queue):
+        self._queue = queue
+
+    def __len__(self):
+        return len(self._queue._play)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        return self._queue._table[self._queue._play[position]]
+
+    def __iter__(self):
+        table = self._queue._table
+        for index in self._queue._play:
+            yield table[index]
+
 
 class QueueManager:
     """
     Queue/playlist logic.
+    - Tracks live in a table that is only ever appended to; a removed track leaves a None slot
+      until the next set_tracks.
+    - Orders are IndexedOrder sequences of table indices: `_base` is playlist order, `_order`
+      the shuffled play order (None when unshuffled, so unshuffling just drops it).
+    - current_index is a play position; history stores table indices, so it survives reshuffles
+      and edits.
+    - Edits act on the play order. While shuffled, inserts also go into playlist order next to
+      their neighbour; moves only reorder the shuffle.
+    - Every change except load/shuffle is deterministic, so the journal can replay it from its op.
     """
     def __init__(self):
         self.playlist_name = "None"
-        self.tracks = []          # list of {"url": ..., "name": ...}
+        self._table = []            # {"url": ..., "name": ...} or None once removed
         self.current_index = 0
 
-        # History stack so "previous" works as expected
-        self.previous_stack = []
+        # Play order
+        self._base = IndexedOrder()
+        self._order = None          # shuffled play order, None → playlist order
+        self._shuffled = False
+
+        # Bounded history of table indices so "previous" works as expected
+        self.previous_stack = deque(maxlen=QUEUE_HISTORY)
 
         # Looping
         self.loop_current = False   # loop current track
         self.loop_playlist = True   # loop playlist end→start
 
-        # Shuffle
-        self._original_order = []   # backup before shuffle
+        # Bumped whenever the play order changes, so prefetchers can tell their list is stale
+        self.order_generation = 0
+        # Bumped on any change a queue view could show (order, position, loop), for snapshots.
+        # Versions carry a per-process epoch, so one seen before a restart never matches after it.
+        self.epoch = os.urandom(4).hex()
+        self.changes = 0
+
+        # Called as journal(op, *args) after every change (see Checkpointer)
+        self.journal = None
 
 
     # =====================================================================
@@ -28,68 +201,83 @@ class QueueManager:
     def set_tracks(self, track_list, playlist_name="None", shuffle=True):
         """Initialize queue with new tracks."""
         self.playlist_name = playlist_name
-        self.tracks = list(track_list)
-        self._original_order = list(track_list)
+        self._table = list(track_list)
+        self._base = IndexedOrder(range(len(self._table)))
+        self._order = None
+        self._shuffled = False
         self.previous_stack.clear()
-
-        # Reset index and guard
         self.current_index = 0
-        if len(self.tracks) == 0:
-            self.current_index = 0
-        else:
-            self.current_index = min(self.current_index, len(self.tracks) - 1)
-            
-        if shuffle:
+
+        if shuffle and len(self._table) > 1:
             self.shuffle()
+        else:
+            self._touch("load", reordered=True)
+
+    @property
+    def _play(self):
+        return self._order if self._order is not None else self._base
+
+    @property
+    def tracks(self):
+        """Tracks in play order (a view, not a copy)."""
+        return PlayOrder(self)
 
     def get_current(self):
         """Return current track dict or None."""
-        if not self.tracks:
+        if not len(self._play):
             return None
-        
-        if self.current_index >= len(self.tracks):
-            self.current_index = len(self.tracks) - 1
-        
-    
-        return self.tracks[self.current_index]
+
+        if self.current_index >= len(self._play):
+            self.current_index = len(self._play) - 1
+
+        return self._track_at(self.current_index)
+
+    def _track_at(self, position):
+        return self._table[self._play[position]]
+
+    @property
+    def version(self):
+        """Opaque queue version, "<epoch>-<changes>"; only compare it for equality."""
+        return f"{self.epoch}-{self.changes}"
+
+    def _touch(self, op, *args, reordered=False):
+        self.changes += 1
+        if reordered:
+            self.order_generation += 1
+        if self.journal:
+            self.journal(op, *args)
 
 
     # =====================================================================
     # SHUFFLE / UNSHUFFLE
     # =====================================================================
     def shuffle(self):
-        """Shuffle all tracks EXCEPT current track."""
-        if len(self.tracks) <= 1:
+        """Shuffle all tracks EXCEPT current track, which moves to the front."""
+        if len(self._play) <= 1:
             return
 
-        current = self.tracks[self.current_index]
-
-        remaining = [
-            t for i, t in enumerate(self.tracks)
-            if i != self.current_index
-        ]
+        current = self._play[self.current_index]
+        rest = [index for index in self._base if index != current]
+        random.shuffle(rest)
 
-        random.shuffle(remaining)
-
-        self.tracks = [current] + remaining
+        self._order = IndexedOrder([current] + rest)
+        self._shuffled = True
+        self.current_index = 0
+        self._touch("shuffle", reordered=True)
 
     def unshuffle(self):
-        """Restore original list order while keeping current track index aligned."""
-        if not self._original_order:
+        """Restore playlist order while keeping the current track."""
+        if not self._shuffled:
             return
 
-        current = self.get_current()
-
-        self.tracks = list(self._original_order)
+        if len(self._order):
+            self.current_index = self._base.position(self._order[self.current_index])
+        self._order = None
+        self._shuffled = False
+        self._touch("unshuffle", reordered=True)
 
-        # Move current index to match track
-        for i, t in enumerate(self.tracks):
-            if t["url"] == current["url"]:
-                self.current_index = i
-                break
-    
     def is_shuffled(self):
-        return self.tracks != self._original_order
+        return self._shuffled
 
     # =====================================================================
     # LOOP CONTROL
@@ -98,6 +286,7 @@ class QueueManager:
         """Toggle looping a single track."""
         self.loop_current = not self.loop_current
         self.loop_playlist = not self.loop_current
+        self._touch("loop")
 
         return "current track" if self.loop_current else "playlist"
 
@@ -107,7 +296,8 @@ class QueueManager:
     # =====================================================================
     def next_track(self):
         """Advance to next track and return it."""
-        if not self.tracks:
+        total = len(self._play)
+        if not total:
             return None
 
         # loop current track
@@ -115,40 +305,191 @@ class QueueManager:
             return self.get_current()
 
         # push to history
-        self.previous_stack.append(self.current_index)
+        self.previous_stack.append(self._play[self.current_index])
         self.current_index += 1
 
         # end of playlist
-        if self.current_index >= len(self.tracks):
+        if self.current_index >= total:
             if self.loop_playlist:
                 self.current_index = 0
             else:
-                self.current_index = len(self.tracks) - 1
+                self.current_index = total - 1
 
+        self._touch("next")
         return self.get_current()
 
     def previous_track(self):
-        """Back up to the last track in the history stack."""
-        if not self.previous_stack:
+        """Back up to the last track in the history stack (skipping removed ones)."""
+        while self.previous_stack:
+            index = self.previous_stack.pop()
+            if self._table[index] is not None:
+                self.current_index = self._play.position(index)
+                self._touch("previous")
+                return self.get_current()
+        return None
+
+    def is_empty(self):
+        return not len(self._play)
+
+    def upcoming(self, count):
+        """Return the next `count` tracks in play order (wrapping if the playlist loops)."""
+        total = len(self._play)
+        if not total or self.loop_current or count <= 0:
+            return []
+
+        upcoming = []
+        for step in range(1, count + 1):
+            i = self.current_index + step
+            if i >= total:
+                if not self.loop_playlist:
+                    break
+                i %= total
+            if i == self.current_index:
+                break
+            upcoming.append(self._track_at(i))
+        return upcoming
+
+
+    # =====================================================================
+    # EDITING
+    # =====================================================================
+    def insert(self, position, tracks):
+        """Insert tracks at a play position (clamped); returns where the first one landed."""
+        tracks = list(tracks)
+        total = len(self._play)
+        position = max(0, min(int(position), total))
+        if not tracks:
+            return position
+
+        # While shuffled, new tracks also join playlist order after their play-order neighbour
+        base_at = 0
+        if self._order is not None and position > 0:
+            base_at = self._base.position(self._order[position - 1]) + 1
+
+        for offset, track in enumerate(tracks):
+            index = len(self._table)
+            self._table.append(track)
+            if self._order is not None:
+                self._order.insert(position + offset, index)
+                self._base.insert(base_at + offset, index)
+            else:
+                self._base.insert(position + offset, index)
+
+        if total and position <= self.current_index:
+            self.current_index += len(tracks)
+        self._touch("insert", position, tracks, reordered=True)
+        return position
+
+    def play_next(self, tracks):
+        """Insert tracks straight after the current one."""
+        return self.insert(self.current_index + 1 if len(self._play) else 0, tracks)
+
+    def remove(self, position):
+        """Remove the track at a play position and return it (None if out of range)."""
+        position = int(position)
+        if not 0 <= position < len(self._play):
             return None
 
-        self.current_index = self.previous_stack.pop()
-        return self.get_current()
+        index = self._play.pop(position)
+        if self._order is not None:
+            self._base.pop(self._base.position(index))
+        track, self._table[index] = self._table[index], None
+
+        if position < self.current_index:
+            self.current_index -= 1
+        self.current_index = min(self.current_index, max(0, len(self._play) - 1))
+        self._touch("remove", position, reordered=True)
+        return track
+
+    def move(self, source, target):
+        """Move the track at play position `source` to `target`. False if either is out of range."""
+        source, target = int(source), int(target)
+        total = len(self._play)
+        if not (0 <= source < total and 0 <= target < total):
+            return False
+        if source == target:
+            return True
+
+        self._play.insert(target, self._play.pop(source))
+
+        current = self.current_index
+        if current == source:
+            self.current_index = target
+        elif source < current <= target:
+            self.current_index -= 1
+        elif target <= current < source:
+            self.current_index += 1
+        self._touch("move", source, target, reordered=True)
+        return True
+
+    def window(self, start, stop):
+        """Tracks at play positions [start, stop), each tagged with its position."""
+        start, stop = max(0, start), min(stop, len(self._play))
+        return [dict(self._track_at(i), position=i) for i in range(start, stop)]
+
 
-    def is_empty(self):
-        return not self.tracks
-    
-    
     # =====================================================================
     # QUEUE EXPORT
     # =====================================================================
+    def snapshot(self, page=1, per_page=10, recent=3):
+        """
+        Just what a queue view shows, tagged with `version`:
+        the current track, up to `recent` before it, and one page of what comes after.
+        Listed tracks carry their absolute play position.
+        """
+        total = len(self._play)
+        current = min(self.current_index, max(0, total - 1))
+        page = max(1, int(page))
+        first = current + 1 + (page - 1) * per_page
+
+        return {
+            "version": self.version,
+            "playlist_name": self.playlist_name,
+            "total": total,
+            "current_index": current,
+            "current": self._track_at(current) if total else None,
+            "recent": self.window(current - recent, current),
+            "page": page,
+            "per_page": per_page,
+            "upcoming": self.window(first, first + per_page),
+            "remaining": max(0, total - (current + 1) - page * per_page),
+            "loop_current": self.loop_current,
+            "shuffle_mode": self._shuffled,
+        }
+
+    def dump(self):
+        """The whole queue as plain data, for checkpoints; restore() takes it back."""
+        return {
+            "playlist_name": self.playlist_name,
+            "tracks": list(self._table),
+            "base": array("l", self._base),
+            "order": array("l", self._order) if self._order is not None else None,
+            "current_index": self.current_index,
+            "history": list(self.previous_stack),
+            "loop_current": self.loop_current,
+        }
+
+    def restore(self, data):
+        self.playlist_name = data["playlist_name"]
+        self._table = list(data["tracks"])
+        self._base = IndexedOrder(data["base"])
+        self._order = IndexedOrder(data["order"]) if data["order"] is not None else None
+        self._shuffled = self._order is not None
+        self.current_index = data["current_index"]
+        self.previous_stack = deque(data["history"], maxlen=QUEUE_HISTORY)
+        self.loop_current = data["loop_current"]
+        self.loop_playlist = not self.loop_current
+        self._touch("load", reordered=True)
+
     def export(self):
         """Return a simplified dict for external inspection."""
         return {
             "playlist_name": self.playlist_name,
             "tracks": self.tracks,
             "current_index": self.current_index,
-            "previous_stack": list(self.previous_stack),
+            "previous_stack": [
+                self._play.position(i) for i in self.previous_stack if self._table[i] is not None
+            ],
             "loop_current": self.loop_current,
-            "shuffle_mode": self.is_shuffled(),
+            "shuffle_mode": self._shuffled,
         }
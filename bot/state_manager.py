@@ -1,5 +1,9 @@
 # bot/state_manager.py
 
+from .audiomixer import MUSIC_LAYER, DEFAULT_AMBIENCE_LAYER
+
+DEFAULT_AMBIENCE_VOLUME = 25
+
 class StateManager:
     """
     Unified runtime state for the bot.
@@ -22,11 +26,8 @@ class StateManager:
         self.shuffle_mode = True
         self.loop_mode = False
 
-        # AMBIENCE STATE
-        self.is_ambience_playing = False
-        self.ambience_name = "None"
-        self.ambience_url = None
-        self.ambience_volume = 25
+        # AMBIENCE STATE (one entry per mixer layer id)
+        self.ambience_layers = {}
 
 
     # =====================================================================
@@ -37,16 +38,34 @@ class StateManager:
         self.voice_client = None
         self.in_vc = False
         self.is_music_playing = False
-        self.is_ambience_playing = False
+        for layer in self.ambience_layers.values():
+            layer["playing"] = False
 
     def set_playlist(self, name, tracks):
         self.playlist_name = name
         self.playlist = tracks
         self.playlist_current = tracks[0] if tracks else {"url": None, "name": "None"}
         
-    def set_ambience(self, name, link):
-        self.ambience_name = name
-        self.ambience_url = link
+    def ambience_layer(self, layer_id=DEFAULT_AMBIENCE_LAYER):
+        """Return the state entry for an ambience layer, creating a blank one if needed."""
+        return self.ambience_layers.setdefault(layer_id, {
+            "name": "None",
+            "url": None,
+            "playing": False,
+            "volume": DEFAULT_AMBIENCE_VOLUME,
+        })
+
+    def set_ambience(self, name, link, layer_id=DEFAULT_AMBIENCE_LAYER):
+        layer = self.ambience_layer(layer_id)
+        layer["name"] = name
+        layer["url"] = link
+
+    def remove_ambience(self, layer_id):
+        self.ambience_layers.pop(layer_id, None)
+
+    @property
+    def is_ambience_playing(self):
+        return any(layer["playing"] for layer in self.ambience_layers.values())
 
     # =====================================================================
     # STATE PACKAGING FOR IPC
@@ -61,16 +80,71 @@ class StateManager:
                 "volume": self.music_volume,
                 "shuffle": self.shuffle_mode,
                 "loop": self.loop_mode,
+                "position": self._position(MUSIC_LAYER),
+                "duration": getattr(getattr(self.core, "playback", None), "current_duration", None),
             },
-            "ambience": {
-                "name": self.ambience_name,
-                "playing": self.is_ambience_playing,
-                "volume": self.ambience_volume,
+            # Default layer keeps the original shape; every layer is listed by id below
+            "ambience": self._ambience_to_dict(
+                self.ambience_layers.get(DEFAULT_AMBIENCE_LAYER), DEFAULT_AMBIENCE_LAYER
+            ),
+            "ambience_layers": {
+                layer_id: self._ambience_to_dict(layer, layer_id)
+                for layer_id, layer in self.ambience_layers.items()
             },
             "in_vc": self.in_vc,
             "bot_online": self.bot_online,
+            "stats": self.collect_stats(),
         }
 
+    def _ambience_to_dict(self, layer, layer_id):
+        if layer is None:
+            return {"name": "None", "playing": False, "volume": DEFAULT_AMBIENCE_VOLUME, "position": 0.0}
+        return {
+            "name": layer["name"],
+            "playing": layer["playing"],
+            "volume": layer["volume"],
+            "position": self._position(layer_id),
+        }
+
+    def _position(self, layer_id):
+        """Seconds into the layer's source, from the mixer's frame count."""
+        mixer = getattr(self.core, "mixer", None)
+        return round(mixer.position(layer_id), 2) if mixer else 0.0
+
+    def collect_stats(self):
+        """Gather counters from the subsystems that expose stats()."""
+        stats = {}
+        if self.core is None:
+            return stats
+
+        mixer = getattr(self.core, "mixer", None)
+        if mixer:
+            stats["mixer"] = mixer.stats()
+
+        playback = getattr(self.core, "playback", None)
+        if playback:
+            stats["playback"] = playback.stats()
+            stats["resolver"] = playback.resolver.stats()
+            stats["loudness"] = playback.loudness.stats()
+
+        ambience_cache = getattr(self.core, "ambience_cache", None)
+        if ambience_cache:
+            stats["ambience_cache"] = ambience_cache.stats()
+
+        track_cache = getattr(self.core, "track_cache", None)
+        if track_cache:
+            stats["track_cache"] = track_cache.stats()
+
+        content = getattr(self.core, "content", None)
+        if content:
+            stats["content"] = content.stats()
+
+        checkpoint = getattr(self.core, "checkpoint", None)
+        if checkpoint:
+            stats["checkpoint"] = checkpoint.stats()
+
+        return stats
+
     def get_state(self):
         """Convenience wrapper to standardize access."""
         return self.to_dict()
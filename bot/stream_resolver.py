@@ -0,0 +1,449 @@
+# bot/stream_resolver.py
+
+import asyncio, json, multiprocessing, os, queue, re, threading, time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+from config import load_json
+from resolver_worker import worker_main
+
+RESOLVER_WORKERS = int(os.getenv("RESOLVER_WORKERS", "2"))
+RESOLVE_TIMEOUT_S = float(os.getenv("RESOLVE_TIMEOUT_S", "20"))
+RESOLVER_MAX_REQUESTS = int(os.getenv("RESOLVER_MAX_REQUESTS", "200"))   # recycle a worker after K calls
+RESOLVER_MAX_RSS_MB = int(os.getenv("RESOLVER_MAX_RSS_MB", "300"))       # ...or once it grows past this
+
+STREAM_CACHE_PATH = os.getenv("STREAM_CACHE_PATH", os.path.join(os.getcwd(), "data", "stream_cache.json"))
+STREAM_CACHE_SIZE = int(os.getenv("STREAM_CACHE_SIZE", "512"))
+STREAM_CACHE_DEFAULT_TTL_S = 30 * 60    # when the URL carries no expire= parameter
+STREAM_CACHE_MARGIN_S = 5 * 60          # never hand out a URL this close to expiring
+STREAM_CACHE_SAVE_DELAY_S = float(os.getenv("STREAM_CACHE_SAVE_DELAY_S", "5"))  # batch writes this long
+
+YOUTUBE_ID = re.compile(r"(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})")
+
+
+class CallAborted(Exception):
+    """Every caller waiting on a resolution went away."""
+
+
+class ResolverWorker:
+    """
+    Parent-side handle on one long-lived resolver process.
+    Only ever used by one pool thread at a time.
+    """
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child,), name="yt-dlp-worker", daemon=True)
+        self.process.start()
+        child.close()
+
+        self.requests = 0
+        self.rss = 0
+        self.ready = False
+
+    def call(self, url, timeout, cancelled=None):
+        """
+        Send url and wait up to `timeout` seconds for the answer.
+        Raises TimeoutError on timeout, CallAborted if `cancelled` gets set, or
+        EOFError/OSError if the worker crashed.
+        """
+        deadline = time.monotonic() + timeout
+
+        if not self.ready:
+            # First call also waits for the worker's YoutubeDL to finish warming up
+            self._recv(deadline, cancelled)
+            self.ready = True
+
+        self.conn.send(url)
+        stream, self.rss = self._recv(deadline, cancelled)
+        self.requests += 1
+        return stream
+
+    def _recv(self, deadline, cancelled):
+        # Wake up regularly so an abort does not have to wait out the timeout
+        while not self.conn.poll(0.1):
+            if cancelled is not None and cancelled.is_set():
+                raise CallAborted()
+            if time.monotonic() >= deadline:
+                raise TimeoutError("resolver worker did not answer in time")
+        return self.conn.recv()
+
+    def worn_out(self, max_requests, max_rss):
+        return self.requests >= max_requests or self.rss >= max_rss
+
+    def stop(self):
+        """Ask the worker to exit; kill it if it does not."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=2)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=2)
+        self.conn.close()
+
+
+class ResolverPool:
+    """
+    A fixed number of warm resolver processes.
+    - Workers are recycled after `max_requests` calls or past `max_rss_mb`, which
+      keeps yt-dlp's slow memory growth out of the bot process entirely.
+    - A worker that crashes or hangs is killed and replaced; the call is retried
+      once on a fresh worker if it crashed.
+    - An aborted call kills its worker too: yt-dlp cannot be interrupted mid-extraction.
+    - Cold (first call on a new worker) and warm call latencies are tracked separately.
+    """
+    def __init__(self, size, timeout, max_requests=RESOLVER_MAX_REQUESTS, max_rss_mb=RESOLVER_MAX_RSS_MB):
+        self.size = size
+        self.timeout = timeout
+        self.max_requests = max_requests
+        self.max_rss = max_rss_mb * 1024 * 1024
+
+        # spawn, not fork: the bot process is full of threads. The worker entry point lives
+        # outside the bot package, so a new worker only imports yt-dlp.
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = 0       # started and not yet retired
+
+        self.restarts = 0
+        self.recycled = 0
+        self.aborted = 0
+        self._latency = {"cold": [0, 0.0], "warm": [0, 0.0]}   # count, total seconds
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._workers < self.size:
+                self._workers += 1
+                return ResolverWorker(self._ctx)
+        return self._idle.get()
+
+    def _retire(self, worker, killed=False):
+        if killed:
+            worker.kill()
+        else:
+            worker.stop()
+        with self._lock:
+            self._workers -= 1
+
+    def resolve(self, url, cancelled=None):
+        """
+        Blocking: resolve url on a pooled worker. Called from the resolver's thread pool.
+        Setting the `cancelled` event aborts the extraction and returns None.
+        """
+        for attempt in (1, 2):
+            worker = self._checkout()
+            cold = worker.requests == 0
+            started = time.monotonic()
+
+            try:
+                stream = worker.call(url, self.timeout, cancelled)
+            except CallAborted:
+                self.aborted += 1
+                self._retire(worker, killed=True)
+                return None
+            except TimeoutError:
+                print(f"[RESOLVER] Worker {worker.process.pid} hung on {url}; restarting it")
+                self.restarts += 1
+                self._retire(worker, killed=True)
+                raise
+            except (EOFError, OSError, BrokenPipeError) as e:
+                print(f"[RESOLVER] Worker {worker.process.pid} crashed ({e!r}); restarting it")
+                self.restarts += 1
+                self._retire(worker, killed=True)
+                if attempt == 1:
+                    continue
+                return None
+
+            bucket = self._latency["cold" if cold else "warm"]
+            bucket[0] += 1
+            bucket[1] += time.monotonic() - started
+
+            if worker.worn_out(self.max_requests, self.max_rss):
+                self.recycled += 1
+                self._retire(worker)
+            else:
+                self._idle.put(worker)
+            return stream
+
+    def stats(self):
+        def avg_ms(bucket):
+            return round(bucket[1] / bucket[0] * 1000, 1) if bucket[0] else None
+
+        return {
+            "processes": self._workers,
+            "restarts": self.restarts,
+            "recycled": self.recycled,
+            "aborted": self.aborted,
+            "cold_ms": avg_ms(self._latency["cold"]),
+            "warm_ms": avg_ms(self._latency["warm"]),
+        }
+
+    def shutdown(self):
+        while True:
+            try:
+                self._retire(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+def canonical_url(url):
+    """Normalize the many YouTube URL shapes to one cache key per video."""
+    match = YOUTUBE_ID.search(url or "")
+    if match:
+        return f"https://www.youtube.com/watch?v={match.group(1)}"
+    return (url or "").strip()
+
+
+def stream_expiry(stream_url):
+    """Unix time a googlevideo URL stops working, from its expire= query parameter."""
+    try:
+        expire = parse_qs(urlparse(stream_url).query).get("expire")
+        if expire:
+            return float(expire[0])
+    except ValueError:
+        pass
+    return time.time() + STREAM_CACHE_DEFAULT_TTL_S
+
+
+class StreamCache:
+    """
+    LRU cache of resolved stream info keyed by canonical track URL.
+    - Each entry lives until its own googlevideo expire= time (minus a margin).
+    - Persisted to disk, so a restart does not trigger a burst of re-resolutions.
+      Changes are batched for STREAM_CACHE_SAVE_DELAY_S, then written on a writer
+      thread to a temp file that replaces the old one, so a crash never leaves half a file.
+    """
+    def __init__(self, path=STREAM_CACHE_PATH, max_entries=STREAM_CACHE_SIZE, save_delay=STREAM_CACHE_SAVE_DELAY_S):
+        self.path = path
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        self._entries = OrderedDict()   # key → {"url", "acodec", "duration", "expires"}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream-cache")
+        self._save_handle = None        # pending debounced save on the event loop
+
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            saved = load_json(self.path, default_data={})
+        except Exception as e:
+            print(f"[RESOLVER] Ignoring unreadable stream cache: {e}")
+            return
+
+        now = time.time()
+        live = [(k, v) for k, v in saved.items() if v.get("expires", 0) - STREAM_CACHE_MARGIN_S > now]
+        for key, entry in live[-self.max_entries:]:
+            self._entries[key] = entry
+        print(f"[RESOLVER] Restored {len(self._entries)} cached stream URLs")
+
+    def save(self):
+        """Write the cache now, on the calling thread (e.g. at shutdown)."""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        self._writer.submit(self._write, dict(self._entries)).result()   # after any queued write
+
+    def _schedule_save(self):
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()     # no event loop to block
+            return
+        self._save_handle = loop.call_later(self.save_delay, self._flush)
+
+    def _flush(self):
+        # Snapshot on the loop thread, which owns _entries; entries are replaced, never mutated
+        self._save_handle = None
+        self._writer.submit(self._write, dict(self._entries))
+
+    def _write(self, entries):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(entries, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self.saves += 1
+        except Exception as e:
+            print(f"[RESOLVER] Could not save stream cache: {e}")
+
+    def get(self, url):
+        key = canonical_url(url)
+        entry = self._entries.get(key)
+
+        if entry and entry["expires"] - STREAM_CACHE_MARGIN_S > time.time():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {"url": entry["url"], "acodec": entry.get("acodec"), "duration": entry.get("duration")}
+
+        if entry:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, url, stream):
+        key = canonical_url(url)
+        self._entries[key] = {
+            "url": stream["url"],
+            "acodec": stream.get("acodec"),
+            "duration": stream.get("duration"),
+            "expires": stream_expiry(stream["url"]),
+        }
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._schedule_save()
+
+    def invalidate(self, url):
+        if self._entries.pop(canonical_url(url), None):
+            self._schedule_save()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saves": self.saves,
+        }
+
+
+class StreamResolver:
+    """
+    Resolves track URLs to direct stream URLs without blocking the event loop.
+    - yt-dlp runs in a ResolverPool of warm worker processes, driven from a
+      bounded thread pool, so IPC, the heartbeat and the Discord gateway keep
+      running while extractions are in flight.
+    - Every call has a timeout. A slot is only given back once its worker thread
+      has actually finished, so a hung extraction cannot over-subscribe the pool.
+    - Results are served from a StreamCache until the stream URL is about to expire.
+    - Concurrent resolutions of the same track share one in-flight extraction,
+      which is only aborted once every caller waiting on it has been cancelled.
+    """
+    def __init__(self, max_workers: int = RESOLVER_WORKERS, timeout: float = RESOLVE_TIMEOUT_S,
+                 cache: StreamCache = None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache if cache is not None else StreamCache()
+
+        self.pool = ResolverPool(max_workers, timeout)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="resolver")
+        self._slots = asyncio.Semaphore(max_workers)
+
+        # canonical URL → [task, number of callers awaiting it]
+        self._inflight = {}
+
+        self.timeouts = 0
+        self.coalesced = 0
+
+    async def resolve(self, url, *, fresh: bool = False):
+        """
+        Resolve url, or return None on failure/timeout. Cancelling the caller
+        abandons the call; work that has not started yet is dropped from the pool.
+        fresh=True skips the cache (e.g. when a cached URL stopped working).
+        """
+        if fresh:
+            self.cache.invalidate(url)
+        else:
+            cached = self.cache.get(url)
+            if cached:
+                return cached
+
+        key = canonical_url(url)
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = [asyncio.create_task(self._resolve_uncached(url)), 0]
+            self._inflight[key] = flight
+            flight[0].add_done_callback(lambda _: self._land(key, flight))
+        else:
+            self.coalesced += 1
+
+        flight[1] += 1
+        try:
+            # shield: one caller being cancelled must not cancel everyone else's result
+            return await asyncio.shield(flight[0])
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not flight[0].done():
+                # Last waiter gone: unregister first, so a new caller starts a fresh
+                # flight instead of joining this one and getting CancelledError
+                self._land(key, flight)
+                flight[0].cancel()   # abort the extraction
+
+    def _land(self, key, flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    async def _resolve_uncached(self, url):
+        try:
+            stream = await asyncio.wait_for(self._run(url), timeout=self.timeout)
+        except (asyncio.TimeoutError, TimeoutError):
+            self.timeouts += 1
+            print(f"[RESOLVER] Timed out after {self.timeout}s: {url}")
+            return None
+
+        if stream:
+            self.cache.put(url, stream)
+        return stream
+
+    async def _run(self, url):
+        loop = asyncio.get_running_loop()
+        await self._slots.acquire()
+
+        cancelled = threading.Event()
+        try:
+            job = self._executor.submit(self.pool.resolve, url, cancelled)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        # Release from the loop thread once the worker is really done (or the job was dropped)
+        job.add_done_callback(lambda _: self._release_slot(loop))
+        try:
+            return await asyncio.wrap_future(job)
+        except asyncio.CancelledError:
+            cancelled.set()     # tell the pool thread to abort its worker
+            raise
+
+    def _release_slot(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._slots.release)
+        except RuntimeError:
+            pass  # loop already closed during shutdown
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "timeouts": self.timeouts,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "pool": self.pool.stats(),
+            "cache": self.cache.stats(),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.shutdown()
+        self.cache.save()
@@ -0,0 +1,155 @@
+# bot/track_metadata.py
+
+import asyncio, os, re, time
+
+from config import load_json, save_json
+from .stream_resolver import canonical_url
+
+TRACK_METADATA_PATH = os.getenv("TRACK_METADATA_PATH", os.path.join(os.getcwd(), "data", "track_metadata.json"))
+LOUDNESS_TARGET_LUFS = float(os.getenv("LOUDNESS_TARGET_LUFS", "-14"))
+LOUDNESS_MAX_GAIN_DB = float(os.getenv("LOUDNESS_MAX_GAIN_DB", "6"))     # never boost more than this
+LOUDNESS_TOLERANCE_DB = float(os.getenv("LOUDNESS_TOLERANCE_DB", "1"))   # closer than this: leave it alone
+LOUDNESS_TIMEOUT_S = int(os.getenv("LOUDNESS_TIMEOUT_S", "300"))
+
+INTEGRATED_LUFS = re.compile(r"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+
+class TrackMetadataStore:
+    """
+    Persistent facts about tracks, keyed by canonical URL (one entry per video).
+    - Stored in data/track_metadata.json; written whenever an entry changes.
+    - Entries are plain dicts, e.g. {"lufs": -9.8, "analyzed_at": ...}.
+    """
+    def __init__(self, path=TRACK_METADATA_PATH):
+        self.path = path
+        try:
+            self._entries = load_json(path, default_data={}) if os.path.exists(path) else {}
+        except Exception as e:
+            print(f"[META] Ignoring unreadable track metadata: {e}")
+            self._entries = {}
+
+    def get(self, url):
+        return self._entries.get(canonical_url(url))
+
+    def update(self, url, **fields):
+        entry = self._entries.setdefault(canonical_url(url), {})
+        entry.update(fields)
+        self.save()
+        return entry
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        save_json(self.path, self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LoudnessAnalyzer:
+    """
+    Measures integrated loudness (EBU R128) of tracks in the background, one at a
+    time, with ffmpeg's ebur128 filter on a throwaway decode. Results go into the
+    metadata store; playback turns them into a plain per-layer gain, so the live
+    ffmpeg chain never runs loudnorm.
+    """
+    def __init__(self, store: TrackMetadataStore, target_lufs=LOUDNESS_TARGET_LUFS):
+        self.store = store
+        self.target_lufs = target_lufs
+        self._pending = {}              # canonical url → asyncio.Task
+        self._slot = asyncio.Semaphore(1)
+
+        self.analyzed = 0
+        self.failed = 0
+
+    # =====================================================================
+    # GAIN
+    # =====================================================================
+    def gain_for(self, url):
+        """Linear gain bringing the track to the target loudness (1.0 if unknown)."""
+        entry = self.store.get(url)
+        if not entry or entry.get("lufs") is None:
+            return 1.0
+
+        gain_db = min(self.target_lufs - entry["lufs"], LOUDNESS_MAX_GAIN_DB)
+        if abs(gain_db) < LOUDNESS_TOLERANCE_DB:
+            return 1.0  # not worth giving up Opus passthrough for
+        return 10 ** (gain_db / 20)
+
+    # =====================================================================
+    # ANALYSIS
+    # =====================================================================
+    def analyze_in_background(self, url, source):
+        """Queue a measurement of url (read from source: a stream URL or local file) unless known."""
+        key = canonical_url(url)
+        entry = self.store.get(url)
+        if entry and "lufs" in entry:
+            return None
+
+        task = self._pending.get(key)
+        if task and not task.done():
+            return task
+
+        task = asyncio.create_task(self._analyze(url, source))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return task
+
+    async def _analyze(self, url, source):
+        async with self._slot:
+            proc = None
+            cmd = ["ffmpeg", "-nostdin", "-hide_banner"]
+            if not os.path.exists(source):
+                cmd += ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5"]
+            cmd += [
+                "-i", source,
+                "-map", "0:a:0", "-vn",
+                "-af", "ebur128=framelog=quiet",
+                "-f", "null", "-",
+            ]
+
+            try:
+                started = time.monotonic()
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+                )
+                _, err = await asyncio.wait_for(proc.communicate(), LOUDNESS_TIMEOUT_S)
+
+                matches = INTEGRATED_LUFS.findall(err.decode(errors="ignore"))
+                if proc.returncode != 0 or not matches:
+                    self.failed += 1
+                    print(f"[META] Loudness analysis failed for {url}")
+                    return None
+
+                lufs = float(matches[-1])
+                if lufs <= -70:
+                    lufs = None  # silence (the gate floor); nothing to normalise
+                self.store.update(url, lufs=lufs, analyzed_at=time.time())
+                self.analyzed += 1
+                print(f"[META] {url}: {lufs} LUFS ({time.monotonic() - started:.1f}s)")
+                return lufs
+
+            except asyncio.CancelledError:
+                if proc and proc.returncode is None:
+                    proc.kill()
+                raise
+
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                self.failed += 1
+                print(f"[META] Loudness analysis timed out for {url}")
+                return None
+
+            except Exception as e:
+                self.failed += 1
+                print(f"[META] Loudness analysis error for {url}: {e}")
+                return None
+
+    def stats(self):
+        return {
+            "tracks": len(self.store),
+            "analyzed": self.analyzed,
+            "failed": self.failed,
+            "pending": len(self._pending),
+            "target_lufs": self.target_lufs,
+        }
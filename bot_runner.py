@@ -2,8 +2,6 @@
 
 import asyncio, os, aiohttp
 
-from bot.bot_core import BotCore
-
 
 # -------------------------------------------------------------
 # Wait for the Web Server (needed so IPC Bridge has somewhere to connect)
@@ -40,6 +38,10 @@ async def main():
     if not token:
         raise RuntimeError("BOT_TOKEN environment variable is missing")
 
+    # Imported here, not at the top: resolver workers are spawned and re-import this
+    # module, and they should not load the whole bot package
+    from bot.bot_core import BotCore
+
     # 1. Create the central bot core
     core = BotCore()
 
@@ -0,0 +1,56 @@
+# resolver_worker.py
+
+# Entry point of the yt-dlp worker processes. Kept outside the bot package: a spawned
+# worker imports this module, and importing bot/ would pull in discord, numpy and the rest.
+
+import os, resource, yt_dlp
+
+
+YDL_OPTS = {
+    "format": "bestaudio[ext=webm][acodec=opus]/bestaudio/best",
+    "quiet": True,
+    "noplaylist": True,
+    "default_search": "auto",
+    "skip_download": True,
+    "socket_timeout": 10,
+}
+
+
+def extract_stream(ydl, url):
+    """Blocking yt-dlp call: track URL → {"url": stream URL, "acodec": codec, "duration": s} or None."""
+    try:
+        info = ydl.extract_info(url, download=False)
+        if not info.get("url"):
+            return None
+        return {"url": info["url"], "acodec": info.get("acodec"), "duration": info.get("duration")}
+    except Exception as e:
+        print(f"[RESOLVER] yt-dlp failed for {url}: {e}")
+        return None
+
+
+def _rss_bytes():
+    """Resident set size of the current process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024   # peak, not current
+
+
+def worker_main(conn):
+    """
+    Resolver worker process (see bot.stream_resolver.ResolverPool): build one YoutubeDL
+    (extractors and all) up front, then answer URLs from the pipe with (stream, rss_bytes)
+    until told to stop.
+    """
+    ydl = yt_dlp.YoutubeDL(YDL_OPTS)
+    conn.send(("ready", _rss_bytes()))
+
+    while True:
+        try:
+            url = conn.recv()
+        except (EOFError, OSError):
+            break
+        if url is None:
+            break
+        conn.send((extract_stream(ydl, url), _rss_bytes()))
@@ -0,0 +1,6 @@
+# tests/conftest.py
+
+import os, sys
+
+# The bot runs from the repo root (bot_runner.py); make `import bot` work the same way here
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,25 @@
+# tests/test_media_cache.py
+
+import json
+
+from bot.media_cache import AmbienceLoopCache
+
+
+def test_truncated_index_is_treated_as_empty(tmp_path):
+    (tmp_path / "index.json").write_text('{"https://example.com/rain": {"size": 1')
+
+    cache = AmbienceLoopCache(directory=str(tmp_path))
+
+    assert cache.index == {}
+
+
+def test_index_is_replaced_whole(tmp_path):
+    cache = AmbienceLoopCache(directory=str(tmp_path))
+    part = tmp_path / "rain.part"
+    part.write_bytes(b"\0" * 3840)
+
+    cache.commit("https://example.com/rain", str(part))
+
+    saved = json.loads((tmp_path / "index.json").read_text())
+    assert saved["https://example.com/rain"]["size"] == 3840
+    assert not (tmp_path / "index.json.tmp").exists()
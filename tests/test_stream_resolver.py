@@ -0,0 +1,80 @@
+# tests/test_stream_resolver.py
+
+import asyncio, time
+
+from bot.stream_resolver import StreamCache, StreamResolver
+
+EXTRACT_S = 0.3         # a slow yt-dlp extraction
+TICK_S = 0.01
+MAX_LAG_S = 0.05        # the loop may fall behind a tick by at most this much
+
+
+class SlowPool:
+    """Stands in for ResolverPool: blocks its calling thread like a real extraction."""
+    def __init__(self):
+        self.calls = 0
+
+    def resolve(self, url, cancelled=None):
+        self.calls += 1
+        time.sleep(EXTRACT_S)
+        return {"url": f"https://stream.example/{url}?expire={int(time.time()) + 3600}", "acodec": "opus"}
+
+    def stats(self):
+        return {}
+
+    def shutdown(self):
+        pass
+
+
+async def _max_loop_lag(until):
+    """Largest delay past a TICK_S sleep while `until` is pending."""
+    lag = 0.0
+    while not until.done():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_S)
+        lag = max(lag, time.perf_counter() - started - TICK_S)
+    return lag
+
+
+def test_slow_extractions_do_not_stall_the_event_loop(tmp_path):
+    async def run():
+        resolver = StreamResolver(max_workers=2, timeout=5, cache=StreamCache(path=str(tmp_path / "cache.json")))
+        resolver.pool.shutdown()
+        resolver.pool = SlowPool()
+        try:
+            # Four tracks on two workers, plus a coalesced duplicate: two rounds of extraction
+            urls = [f"https://youtu.be/track{i:06d}" for i in range(4)] + ["https://youtu.be/track000000"]
+            resolves = asyncio.ensure_future(asyncio.gather(*(resolver.resolve(url) for url in urls)))
+            lag = await _max_loop_lag(resolves)
+            return await resolves, lag, resolver
+        finally:
+            resolver.shutdown()
+
+    streams, lag, resolver = asyncio.run(run())
+
+    assert all(streams)
+    assert resolver.pool.calls == 4
+    assert resolver.coalesced == 1
+    assert lag < MAX_LAG_S, f"event loop stalled {lag * 1000:.1f} ms"
+
+
+def test_caller_after_an_abandoned_flight_gets_a_result(tmp_path):
+    async def run():
+        resolver = StreamResolver(max_workers=2, timeout=5, cache=StreamCache(path=str(tmp_path / "cache.json")))
+        resolver.pool.shutdown()
+        resolver.pool = SlowPool()
+        try:
+            url = "https://youtu.be/track000000"
+            first = asyncio.create_task(resolver.resolve(url))
+            await asyncio.sleep(0.05)
+            first.cancel()
+            await asyncio.sleep(0)      # the first caller's cleanup cancels its flight
+
+            return await resolver.resolve(url), resolver
+        finally:
+            resolver.shutdown()
+
+    stream, resolver = asyncio.run(run())
+
+    assert stream is not None
+    assert resolver.coalesced == 0
@@ -19,33 +19,32 @@ def _md_escape(s: str) -> str:
              .replace(')', r'\)'))
 
 
-def render_queue_embed(queue: dict, page: int = 1, per_page: int = 10) -> discord.Embed:
+def render_queue_embed(snapshot: dict) -> discord.Embed:
     """
-    queue = {
+    snapshot = QueueManager.snapshot(page, per_page):
         "playlist_name": str,
-        "tracks": [{"name": str, "url": str}, ...],
+        "total": int,
         "current_index": int,
+        "current": {"name": str, "url": str} | None,
+        "recent": [{"name": str, "url": str, "position": int}, ...],
+        "page": int,
+        "upcoming": [{"name": str, "url": str, "position": int}, ...],
+        "remaining": int,
         "loop_current": bool,
         "shuffle_mode": bool }
     """
-    name = queue.get("playlist_name") or "None"
-    tracks = queue.get("tracks") or []
-    cur = max(0, queue.get("current_index", 0))
-    total = len(tracks)
-
-    # Clamp index
-    if total == 0:
-        cur = 0
-    elif cur >= total:
-        cur = total - 1
+    name = snapshot.get("playlist_name") or "None"
+    total = snapshot.get("total", 0)
+    cur = snapshot.get("current_index", 0)
+    page = snapshot.get("page", 1)
 
     # ===================================================================
     # NOW PLAYING BLOCK
     # ===================================================================
     box_width = BOX_WIDTH
 
-    if total > 0:
-        now_title = _md_escape(tracks[cur]["name"])[:box_width]
+    if snapshot.get("current"):
+        now_title = _md_escape(snapshot["current"]["name"])[:box_width]
         title_line = now_title.center(box_width)
 
         now_block = (
@@ -66,27 +65,21 @@ def render_queue_embed(queue: dict, page: int = 1, per_page: int = 10) -> discor
     # Recently Played (up to 3)
     # ===================================================================
     recent_lines = []
-    if total > 0 and cur > 0:
-        start = max(0, cur - 3)
-        for i in range(start, cur):
-            idx = f"{i+1}."
-            title = _md_escape(tracks[i]["name"])
-            recent_lines.append(f"{idx:>3}  {title}")
+    for track in snapshot.get("recent") or []:
+        idx = f"{track['position']+1}."
+        title = _md_escape(track["name"])
+        recent_lines.append(f"{idx:>3}  {title}")
 
     # ===================================================================
     # Up Next — paginated
     # ===================================================================
     upnext_lines = []
-    page_start = cur + 1 + (page - 1) * per_page
-    page_end = min(total, page_start + per_page)
-
-    if page_start < total:
-        for i in range(page_start, page_end):
-            idx = f"{i+1}."
-            title = _md_escape(tracks[i]["name"])
-            upnext_lines.append(f"{idx:>3}  {title}")
+    for track in snapshot.get("upcoming") or []:
+        idx = f"{track['position']+1}."
+        title = _md_escape(track["name"])
+        upnext_lines.append(f"{idx:>3}  {title}")
 
-    remaining = max(0, (total - (cur + 1)) - (page * per_page))
+    remaining = snapshot.get("remaining", 0)
 
     # ===================================================================
     # BUILD EMBED
@@ -117,8 +110,8 @@ def render_queue_embed(queue: dict, page: int = 1, per_page: int = 10) -> discor
                      inline=False)
 
     em.set_footer(
-        text=f" Loop: {'On' if queue.get('loop_current') else 'Off'}"
-             f"  •  Shuffle: {'On' if queue.get('shuffle_mode') else 'Off'}"
+        text=f" Loop: {'On' if snapshot.get('loop_current') else 'Off'}"
+             f"  •  Shuffle: {'On' if snapshot.get('shuffle_mode') else 'Off'}"
              f"  •  Tracks: {total}"
     )
 